@@ -24,9 +24,9 @@ def exhandler(function, parser):
     if args["examples"]:
         function()
         return
-    if args["verbose"]:
-        from liveserial.msg import set_verbosity
-        set_verbosity(args["verbose"])
+    if args["verbose"] or args["debug"]:
+        from basis.msg import set_verbosity
+        set_verbosity(args["verbose"] or 3)
 
     args.update(vars(parser.parse_known_args()[0]))
     return args
@@ -0,0 +1,163 @@
+"""Runs batches of independent solves (parameter sweeps, basis convergence
+studies, etc.) in parallel on a pool of worker processes.
+
+Each solve is described by a spec, a `dict` with the keys:
+
+- **potcfg** (str): path to the potential configuration file.
+- **n_basis** (int): the number of basis functions.
+- **outfile** (str): where the solution is written.
+- **n_solutions** (int, optional): the number of solutions written;
+  defaults to 10.
+- **xi**, **xf** (float, optional): the edges of the domain.
+- **params** (dict, optional): values for the potential's parameters, see
+  :meth:`basis.potential.Potential.adjust_potential`.
+- **format** (str, optional): the output format, see :mod:`basis.output`;
+  defaults to 'text'.
+- **options** (dict, optional): other keyword arguments for
+  :class:`basis.hamiltonian.Hamiltonian`.
+
+The workers are spawned with the BLAS thread limits set in their
+environment, so the limits are in place before they load `numpy`.
+"""
+
+import os
+from contextlib import contextmanager
+from basis import msg
+
+thread_variables = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                    "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS",
+                    "NUMEXPR_NUM_THREADS"]
+"""list: environment variables that set the number of threads used by the
+common BLAS/LAPACK libraries.
+"""
+
+def spec_grid(base, **ranges):
+    """Builds the specs for every combination of the given values.
+
+    Args:
+        base (dict): the settings shared by all the specs. If its `outfile`
+          has format fields, they are filled in from each spec and its
+          `params`, e.g. `"kp_{n_basis}_{v0}.dat"`.
+        ranges (dict): spec keys and the list of values to use for each;
+          `params` takes a list of parameter dicts.
+
+    Returns:
+        list of dict: the specs; the last range given varies fastest.
+
+    Examples:
+        >>> specs = spec_grid({"potcfg": "kp.cfg", "outfile": "kp_{n_basis}.dat"},
+        ...                   n_basis=[50, 100, 200])
+    """
+
+    from itertools import product
+    keys = list(ranges)
+    specs = []
+    for values in product(*[ranges[key] for key in keys]):
+        spec = dict(base)
+        spec.update(zip(keys, values))
+        fields = dict(spec)
+        fields.update(spec.get("params", {}))
+        spec["outfile"] = spec["outfile"].format(**fields)
+        specs.append(spec)
+
+    return specs
+
+@contextmanager
+def _limit_threads(n_threads):
+    """Limits the number of BLAS threads of the processes spawned in the
+    `with` block. The spawned processes inherit this process's environment
+    and load `numpy` after it is set, whereas a worker initializer would run
+    too late: the spawned worker has already imported the parent's
+    `__main__`, and with it `numpy`. The environment is restored afterwards.
+    """
+    saved = dict((var, os.environ.get(var)) for var in thread_variables)
+    for var in thread_variables:
+        os.environ[var] = str(n_threads)
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                del os.environ[var]
+            else:
+                os.environ[var] = value
+
+def solve_spec(spec):
+    """Solves the system described by a single spec and writes its solution.
+    The solution is written to a temporary file first and renamed, so an
+    interrupted batch never leaves a partial output behind.
+
+    Args:
+        spec (dict): the solve to run; see the module documentation.
+
+    Returns:
+        np.ndarray: the eigenvalues that were written.
+    """
+
+    from basis.hamiltonian import Hamiltonian
+    from basis.output import write_solution
+
+    n_solutions = spec.get("n_solutions", 10)
+    options = dict(spec.get("options", {}))
+    options.setdefault("n_solutions", n_solutions)
+    ham = Hamiltonian(spec["potcfg"], spec["n_basis"], spec.get("xi"),
+                      spec.get("xf"), **options)
+    if spec.get("params"):
+        ham.adjust_potential(**spec["params"])
+
+    partial = spec["outfile"] + ".part"
+    write_solution(ham, n_solutions, partial, spec.get("format", "text"))
+    os.replace(partial, spec["outfile"])
+    return ham.eigenvals[:n_solutions]
+
+def run_batch(specs, max_workers=None, blas_threads=1, resume=True):
+    """Solves a batch of specs on a pool of worker processes.
+
+    Args:
+        specs (list of dict): the solves to run; see the module
+          documentation.
+        max_workers (int, optional): the number of worker processes; defaults
+          to the number of CPUs.
+        blas_threads (int, optional): the number of BLAS threads each worker
+          may use. The default of 1 avoids oversubscribing the CPUs when
+          every worker runs a dense eigensolver.
+        resume (bool, optional): when True, specs whose output file already
+          exists are skipped, so an interrupted batch can be restarted.
+
+    Returns:
+        list of dict: one result per spec, in the same order as `specs`, with
+          keys `spec`, `outfile`, `skipped` and `eigenvals` (None when the
+          spec was skipped).
+    """
+
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    results = []
+    pending = []
+    for spec in specs:
+        result = {"spec": spec, "outfile": spec["outfile"],
+                  "skipped": False, "eigenvals": None}
+        if resume and os.path.isfile(spec["outfile"]):
+            result["skipped"] = True
+            msg.info("Skipping {}; it already exists.".format(spec["outfile"]), 2)
+        else:
+            pending.append(result)
+        results.append(result)
+
+    if len(pending) == 0:
+        return results
+
+    # Workers are spawned rather than forked so that they start a fresh
+    # numpy that honors the thread limits in their environment.
+    context = multiprocessing.get_context("spawn")
+    with _limit_threads(blas_threads), \
+         ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=context) as pool:
+        futures = [pool.submit(solve_spec, result["spec"])
+                   for result in pending]
+        for result, future in zip(pending, futures):
+            result["eigenvals"] = future.result()
+            msg.okay("Wrote {}.".format(result["outfile"]), 2)
+
+    return results
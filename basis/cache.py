@@ -0,0 +1,159 @@
+"""An on-disk cache of assembled hamiltonian matrices and their eigenstates.
+Entries are addressed by a hash of everything that determines them (the
+potential's fingerprint, the basis size, the domain and the assembly or
+solver settings), so identical systems are only ever solved once.
+"""
+
+import json
+import hashlib
+import os
+import numpy as np
+
+default_size = 2**30
+"""int: the default maximum size of the cache in bytes.
+"""
+
+class SolutionCache(object):
+    """A size-bounded directory of cached hamiltonians and eigenstates. When
+    the cache grows past its maximum size the least recently used entries
+    are removed.
+
+    Args:
+        directory (str): where the cache files are kept; it is created if it
+          doesn't exist.
+        max_size (int, optional): the maximum total size of the cache files
+          in bytes.
+
+    Attributes:
+        directory (str): absolute path to the cache directory.
+        max_size (int): the maximum total size of the cache files in bytes.
+
+    Examples:
+        >>> from basis.cache import SolutionCache
+        >>> from basis.hamiltonian import Hamiltonian
+        >>> cache = SolutionCache("~/.basis_cache")
+        >>> h = Hamiltonian("kp.cfg", 1000, cache=cache)
+    """
+
+    def __init__(self, directory, max_size=default_size):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_size = max_size
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def matrix_key(self, ham):
+        """Returns the key of the hamiltonian's matrix.
+        """
+        return _hash([ham.pot.fingerprint(), ham.n_basis,
+                      [float(x) for x in ham.domain], ham.assembly,
+                      ham.storage, ham.divs, ham.tol, ham.samples,
+                      ham.quad_order])
+
+    def eigen_key(self, ham):
+        """Returns the key of the hamiltonian's eigenstates.
+        """
+        window = ham.energy_window
+        if window is not None:
+            window = [float(e) for e in window]
+        return _hash([self.matrix_key(ham), ham.n_solutions, window,
+                      ham.solver])
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    def load_matrix(self, ham):
+        """Returns the cached matrix for the hamiltonian, or None.
+        """
+        path = self._path(self.matrix_key(ham), ".npy")
+        if not os.path.isfile(path):
+            return None
+        os.utime(path, None)
+        return np.load(path)
+
+    def store_matrix(self, ham, matrix):
+        """Adds the hamiltonian's matrix to the cache.
+        """
+        path = self._path(self.matrix_key(ham), ".npy")
+        with _Replace(path) as f:
+            np.save(f, matrix)
+        self.evict()
+
+    def load_eigen(self, ham):
+        """Returns the cached (eigenvals, eigenvecs) for the hamiltonian, or
+        None.
+        """
+        path = self._path(self.eigen_key(ham), ".npz")
+        if not os.path.isfile(path):
+            return None
+        os.utime(path, None)
+        with np.load(path) as data:
+            return data["eigenvals"], data["eigenvecs"]
+
+    def store_eigen(self, ham, eigen):
+        """Adds the hamiltonian's (eigenvals, eigenvecs) to the cache.
+        """
+        path = self._path(self.eigen_key(ham), ".npz")
+        with _Replace(path) as f:
+            np.savez(f, eigenvals=eigen[0], eigenvecs=eigen[1])
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is no
+        larger than `max_size`.
+        """
+
+        # Other processes sharing the directory may remove entries at the
+        # same time, so entries that have disappeared are skipped.
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy") or name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """Removes every entry from the cache.
+        """
+        max_size, self.max_size = self.max_size, -1
+        self.evict()
+        self.max_size = max_size
+
+class _Replace(object):
+    """Opens a temporary file for writing that replaces `path` once it is
+    closed without errors, so readers never see partial cache entries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.partial = "{}.{}.part".format(path, os.getpid())
+
+    def __enter__(self):
+        self.f = open(self.partial, "wb")
+        return self.f
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.f.close()
+        if exc_type is None:
+            os.replace(self.partial, self.path)
+        else:
+            os.remove(self.partial)
+
+def _hash(values):
+    """Returns the hex digest of the hash of a JSON serializable list.
+    """
+    source = json.dumps(values, sort_keys=True)
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
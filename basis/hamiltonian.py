@@ -1,14 +1,187 @@
 """Methods used to setup the Hamiltonian of the system."""
 
 import numpy as np
-from basis import msg
-from basis.potential import Potential
+from basis import msg, timing
+from basis.potential import (Potential, TabulatedPotential, StepFunction,
+                             load_potential)
+
+assembly_methods = ["vectorized", "reference", "dst", "quadrature"]
+"""list: the methods available for assembling the hamiltonian matrix.
+"""
+storage_modes = ["full", "upper", "packed", "structured"]
+"""list: the ways the assembled hamiltonian matrix can be stored.
+"""
+eigen_solvers = ["subset", "lanczos"]
+"""list: the methods available for diagonalizing the hamiltonian.
+"""
+
+def cosine_coefficients(values, xi, L, k_max):
+    """Finds the cosine coefficients `C_k = (1/L) int V(x) cos(k pi x/L) dx`
+    over the domain from samples of the potential, for `k = 0..k_max`. The
+    samples are taken at the midpoints of `M` equal cells, so the integrals
+    are midpoint sums, which are all read off a single zero padded FFT.
+
+    Args:
+        values (np.ndarray): The potential at `xi + (j + 1/2)*L/M` for
+          `j = 0..M-1`.
+        xi (float): The left edge of the domain.
+        L (float): The width of the domain.
+        k_max (int): The largest mode index needed; it can't exceed `M`.
+
+    Returns:
+        np.ndarray: The coefficients indexed by `k`.
+
+    Raises:
+        ValueError: if there are fewer than `k_max` samples.
+    """
+
+    M = len(values)
+    if k_max > M:
+        emsg = "{} samples can only resolve modes up to {}, not {}."
+        raise ValueError(emsg.format(M, M, k_max))
+
+    # sum_j V_j exp(-i pi k j/M) for k = 0..M; the basis is defined on the
+    # absolute positions so the phase of the first sample is put back.
+    spectrum = np.fft.rfft(values, 2*M)[:k_max+1]
+    k = np.arange(k_max+1)
+    phase = np.exp(-1j*np.pi*k*(xi/L + 0.5/M))
+    return np.real(phase*spectrum)/M
+
+def pack_upper(matrix):
+    """Packs the upper triangle (including the diagonal) of a square matrix
+    into a 1D array, row by row.
+
+    Args:
+        matrix (np.ndarray): The square matrix to pack.
+
+    Returns:
+        np.ndarray: The n*(n+1)/2 upper triangle entries of `matrix`.
+    """
+
+    return matrix[np.triu_indices(len(matrix))]
+
+def unpack_upper(packed, symmetric=True):
+    """Expands a row by row packed upper triangle into a square matrix.
+
+    Args:
+        packed (np.ndarray): The packed upper triangle from :func:`pack_upper`.
+        symmetric (bool, optional): When True the lower triangle is filled
+          in by symmetry, otherwise it is left as zeros.
+
+    Returns:
+        np.ndarray: The square matrix.
+
+    Raises:
+        ValueError: if the length of `packed` is not a triangular number.
+    """
+
+    n = int(round((np.sqrt(8*len(packed) + 1) - 1)/2))
+    if n*(n+1)//2 != len(packed):
+        emsg = "{} entries can't be unpacked into a square matrix."
+        raise ValueError(emsg.format(len(packed)))
+
+    matrix = np.zeros((n, n), dtype=packed.dtype)
+    rows, cols = np.triu_indices(n)
+    matrix[rows, cols] = packed
+    if symmetric:
+        matrix[cols, rows] = packed
+    return matrix
+
+def _packed_offset(i, n):
+    """Returns the index of the diagonal entry of row `i` in the row by row
+    packing of an `n` by `n` upper triangle; row `i` starts after the
+    `i*(i+1)/2` lower triangle entries that were skipped.
+    """
+    return i*n - i*(i-1)//2
+
+class ToeplitzHankel(object):
+    """The hamiltonian in the sine basis, stored by its structure. The
+    potential's matrix element between the basis functions `n` and `m` is
+    `C_|n-m| - C_(n+m)`, where `C_k` are its cosine coefficients, so the
+    potential part of the matrix is a Toeplitz minus a Hankel matrix. Only
+    the `2N+1` coefficients and the kinetic energy diagonal are kept, and
+    products with vectors are found as FFT convolutions in O(N log N).
+
+    Args:
+        diag (np.ndarray): The kinetic energy of each basis function.
+        coefficients (np.ndarray): The cosine coefficients `C_0..C_2N` of
+          the potential.
+
+    Attributes:
+        diag (np.ndarray): The kinetic energy of each basis function.
+        coefficients (np.ndarray): The cosine coefficients of the potential.
+        shape (tuple): The shape of the matrix that is represented.
+    """
+
+    def __init__(self, diag, coefficients):
+        N = len(diag)
+        if len(coefficients) < 2*N + 1:
+            emsg = "{} basis functions need {} cosine coefficients, not {}."
+            raise ValueError(emsg.format(N, 2*N + 1, len(coefficients)))
+        self.diag = diag
+        self.coefficients = coefficients
+        self.shape = (N, N)
+
+        C = coefficients
+        # Both kernels have 2N-1 entries, so a linear convolution with an
+        # N-vector needs at least 3N-2 points.
+        self._size = 2**int(np.ceil(np.log2(max(3*N - 2, 1))))
+        toeplitz = np.concatenate([C[N-1:0:-1], C[:N]])
+        hankel = C[2:2*N+1]
+        self._toeplitz = np.fft.rfft(toeplitz, self._size)
+        self._hankel = np.fft.rfft(hankel, self._size)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def matvec(self, v):
+        """Multiplies the matrix with a vector, or with each column of a
+        matrix.
+
+        Args:
+            v (np.ndarray): A vector of length N, or an (N, k) array.
+
+        Returns:
+            np.ndarray: The product, with the same shape as `v`.
+        """
+
+        N = self.shape[0]
+        v = np.asarray(v)
+        size = self._size
+        forward = np.fft.rfft(v, size, axis=0)
+        backward = np.fft.rfft(v[::-1], size, axis=0)
+        shape = (-1,) + (1,)*(v.ndim - 1)
+        product = (self._toeplitz.reshape(shape)*forward -
+                   self._hankel.reshape(shape)*backward)
+        result = np.fft.irfft(product, size, axis=0)[N-1:2*N-1]
+        return self.diag.reshape(shape)*v + result
+
+    def diagonal(self):
+        """Returns the diagonal of the matrix.
+        """
+
+        n = np.arange(1, self.shape[0] + 1)
+        C = self.coefficients
+        return self.diag + C[0] - C[2*n]
+
+    def todense(self):
+        """Returns the full (N, N) matrix.
+        """
+
+        N = self.shape[0]
+        n = np.arange(N)
+        C = self.coefficients
+        matrix = C[np.abs(n[:,None] - n)] - C[n[:,None] + n + 2]
+        matrix[n, n] += self.diag
+        return matrix
 
 class Hamiltonian(object):
     """Represents the Hamliltonian for a 1D quantum potential.
 
     Args:
-        potcfg (str): path to the potential configuration file. 
+        potcfg (str or Potential): path to the potential configuration file
+          or to a table of the potential (see
+          :func:`basis.potential.load_potential`), or the potential itself.
         n_basis (int): The number of basis functions to use in the solution.
         xi (float, optional): The left most edge of the potential. If
           not specified then it is assumed to be the left most edge of the
@@ -16,36 +189,243 @@ class Hamiltonian(object):
         xf (float, optional): The right most edge of the potential. If
           not specified then it is assumed to be the left most edge of the
           potential as defined in `potcfg'.
+        assembly (str, optional): How the hamiltonian matrix is built; one
+          of :data:`assembly_methods`. Defaults to 'dst' for tabulated
+          potentials, whose every grid cell would otherwise be a barrier,
+          and to 'vectorized' otherwise. 'vectorized' builds the
+          matrix with array operations; 'reference' builds it one element
+          at a time; 'dst' projects samples of the potential onto the
+          basis with an FFT (see :func:`cosine_coefficients`), which suits
+          smooth or tabulated potentials; 'quadrature' integrates the
+          potential with Gauss-Legendre quadrature on panels between the
+          region edges, which suits smooth potentials.
+        storage (str, optional): How the hamiltonian matrix is stored; one
+          of :data:`storage_modes`. 'full' (the default) stores the whole
+          symmetric matrix; 'upper' only fills the upper triangle and leaves
+          the lower triangle as zeros; 'packed' stores the upper triangle
+          in a 1D array (see :func:`pack_upper`). Only the upper triangle
+          is ever computed, a block of rows at a time, so the assembly
+          needs little more memory than the stored matrix. The dense
+          solvers expand a packed matrix into a full work array; the
+          'lanczos' solver uses it as it is, so packed storage with that
+          solver halves the peak memory. 'structured' only keeps the
+          kinetic energy and the cosine coefficients of the potential in a
+          :class:`ToeplitzHankel` operator for bases too large for a dense
+          matrix; it needs the 'lanczos' solver, and is solved with the
+          preconditioned LOBPCG iteration instead of ARPACK.
+        n_solutions (int, optional): The number of lowest energy states to
+          solve for. If not specified then the full spectrum is found.
+        energy_window (tuple, optional): `(emin, emax)`; only the states
+          with `emin < E <= emax` are solved for. Ignored if `n_solutions`
+          is specified.
+        solver (str, optional): How the eigenstates are found; one of
+          :data:`eigen_solvers`. 'subset' (the default) uses the LAPACK
+          index/value range drivers from `scipy` when it is installed, and
+          a full `numpy` diagonalization otherwise. 'lanczos' finds the
+          lowest `n_solutions` states with `scipy`'s preconditioned block
+          Krylov iteration (LOBPCG), which only multiplies the matrix as it
+          is stored with blocks of vectors.
+        divs (float, optional): The sampling step used to find the changes
+          in the potential inside regions defined by functions. If not
+          specified it is picked from the potential's parameters.
+        tol (float, optional): How precisely the jumps in the potential are
+          located. Defaults to 1e-12 of the domain's width.
+        cache (:obj:`basis.cache.SolutionCache`, optional): an on-disk cache
+          that the matrix and eigenstates are read from, if they are in it,
+          and added to otherwise.
+        samples (int, optional): The number of samples of the potential used
+          by the 'dst' assembly. Defaults to a power of two no smaller than
+          4096 or 16 times the number of basis functions.
+        quad_order (int, optional): The number of Gauss-Legendre nodes per
+          panel used by the 'quadrature' assembly; at least 2, so that the
+          error can be estimated from a rule with half as many nodes.
     
     Attributes: 
         pot (:obj:`Potential`): A Potential object that
           represents the potential for the 1D quantum system.
         eigenvals (list): The energy eigenvalues for the sysetm.
-        eigenvecs (list): The eigenvectors for the system.
-        ham (np.ndarray): An array of the hamiltonian.
+        eigenvecs (list): The eigenvectors for the system; one per column.
+        ham (np.ndarray): An array of the hamiltonian, stored as
+          specified by `storage`.
+        n_basis (int): The number of basis functions in the expansion.
         domain (list): The region over which the potential is defined.
+        assembly (str): The method used to build the hamiltonian matrix.
+        storage (str): How the hamiltonian matrix is stored.
+        n_solutions (int): The number of lowest states solved for, or None.
+        energy_window (tuple): The energy window solved for, or None.
+        solver (str): The method used to diagonalize the hamiltonian.
+        divs (float): The sampling step used inside function regions.
+        tol (float): How precisely the jumps in the potential are located.
+        cache (:obj:`basis.cache.SolutionCache`): The on-disk cache, or None.
+        samples (int): The number of samples used by the 'dst' assembly, or
+          None for the default.
+        quad_order (int): The number of nodes per panel used by the
+          'quadrature' assembly.
+        quad_error (float): An estimate of the largest error in the
+          potential's matrix elements from the 'quadrature' assembly: the
+          change from a rule with half as many nodes, which bounds the
+          error generously. None until the matrix is assembled.
 
     Examples:
         >>> from basis.hamiltonian import Hamiltonian
-        >>> h = hamiltonian("sho.cfg", 10)
-        >>> energy = h.eigenvals()
-        >>> eigenvecs = h.eigenves()
+        >>> h = Hamiltonian("sho.cfg", 10)
+        >>> energy = h.eigenvals
+        >>> eigenvecs = h.eigenvecs
+
+        The matrix and the eigenstates are only computed when they are first
+        accessed, and are cached until :meth:`invalidate` is called.
 
     """
 
-    def __init__(self, potcfg, n_basis, xi = None, xf = None):
-        self.pot = Potential(potcfg)
+    def __init__(self, potcfg, n_basis, xi = None, xf = None,
+                 assembly = None, storage = "full",
+                 n_solutions = None, energy_window = None, solver = "subset",
+                 divs = None, tol = None, cache = None, samples = None,
+                 quad_order = 16):
+        if isinstance(potcfg, Potential):
+            self.pot = potcfg
+        else:
+            self.pot = load_potential(potcfg)
+        if assembly is None:
+            tabulated = isinstance(self.pot, TabulatedPotential)
+            assembly = "dst" if tabulated else "vectorized"
+        if assembly not in assembly_methods:
+            emsg = "'{}' is not a valid assembly method; use one of {}."
+            raise ValueError(emsg.format(assembly, assembly_methods))
+        self.assembly = assembly
+        if storage not in storage_modes:
+            emsg = "'{}' is not a valid storage mode; use one of {}."
+            raise ValueError(emsg.format(storage, storage_modes))
+        self.storage = storage
+        if solver not in eigen_solvers:
+            emsg = "'{}' is not a valid eigen solver; use one of {}."
+            raise ValueError(emsg.format(solver, eigen_solvers))
+        if solver == "lanczos" and n_solutions is None:
+            raise ValueError("The 'lanczos' solver needs `n_solutions`.")
+        if n_solutions is not None and n_solutions < 1:
+            emsg = "`n_solutions` has to be at least 1, not {}."
+            raise ValueError(emsg.format(n_solutions))
+        if storage == "structured" and solver != "lanczos":
+            raise ValueError("'structured' storage needs the 'lanczos' "
+                             "solver.")
+        self.solver = solver
+        self.n_solutions = n_solutions
+        self.energy_window = energy_window
+
+        self.n_basis = n_basis
+        self.cache = cache
+        self.samples = samples
+        if quad_order < 2:
+            emsg = "`quad_order` has to be at least 2, not {}."
+            raise ValueError(emsg.format(quad_order))
+        self.quad_order = quad_order
+        self.quad_error = None
+        self._settings = (xi, xf, divs, tol)
+        self._set_domain()
+        self._ham = None
+        self._eigen = None
+        self._heights = {}
+        self._sines = {}
+        self._kinetic = None
+        self._steps = None
+
+    @property
+    def ham(self):
+        """np.ndarray: The hamiltonian matrix; it is assembled the first time
+        it is accessed. With 'structured' storage it is a
+        :class:`ToeplitzHankel` operator, which is cheap to rebuild and so
+        isn't cached on disk.
+        """
+        cached = self.cache is not None and self.storage != "structured"
+        if self._ham is None and cached:
+            with timing.phase("cache"):
+                self._ham = self.cache.load_matrix(self)
+        if self._ham is None:
+            with timing.phase("assemble"):
+                self._construct_ham(self.n_basis)
+            if cached:
+                with timing.phase("cache"):
+                    self.cache.store_matrix(self, self._ham)
+        return self._ham
+
+    @property
+    def eigenvals(self):
+        """np.ndarray: The energy eigenvalues; the hamiltonian is diagonalized
+        the first time they (or the eigenvectors) are accessed.
+        """
+        if self._eigen is None:
+            self._solve()
+        return self._eigen[0]
+
+    @property
+    def eigenvecs(self):
+        """np.ndarray: The eigenvectors, one per column; see `eigenvals`.
+        """
+        if self._eigen is None:
+            self._solve()
+        return self._eigen[1]
+
+    def _solve(self):
+        """Finds the eigenstates, or reads them from the cache.
+        """
+        if self.cache is not None:
+            with timing.phase("cache"):
+                self._eigen = self.cache.load_eigen(self)
+        if self._eigen is None:
+            # The matrix is assembled first so that it isn't timed as part
+            # of the diagonalization.
+            self.ham
+            with timing.phase("diagonalize"):
+                self._eigen = self._diagonalize()
+            if self.cache is not None:
+                with timing.phase("cache"):
+                    self.cache.store_eigen(self, self._eigen)
+
+    def _set_domain(self):
+        """Sets the domain, `divs` and `tol`, deriving the ones that weren't
+        specified from the potential.
+        """
 
+        xi, xf, divs, tol = self._settings
         if xi == None:
             xi = self._find_xi()
         if xf == None:
             xf = self._find_xf()
 
         self.domain = [xi,xf]
-        self.ham = None
-        self._construct_ham(n_basis)
+        self.divs = self._default_divs() if divs is None else divs
+        self.tol = 1e-12*abs(xf - xi) if tol is None else tol
+
+    def adjust_potential(self, **kwargs):
+        """Adjusts the parameters of the potential and discards the parts of
+        the solution that depend on them. The kinetic energy (the diagonal
+        of the hamiltonian without the potential) and the sine terms at the
+        barrier edges are kept, so only the potential part of the matrix is
+        reassembled. Edges of the domain that were not specified are found
+        again from the adjusted potential.
+
+        Args:
+            kwargs (dict): parameters and values to overwrite.
+        """
+
+        self.pot.adjust_potential(**kwargs)
+        self._set_domain()
+        self.invalidate()
 
-        self.eigenvals, self.eigenvecs = np.linalg.eigh(self.ham)
+    def invalidate(self, ham=True):
+        """Discards the cached eigenstates so that they are recomputed the
+        next time they are accessed. Call this after changing the potential
+        or any of the solver settings.
+
+        Args:
+            ham (bool, optional): When True the hamiltonian matrix is also
+              discarded and reassembled on its next access.
+        """
+        self._eigen = None
+        if ham:
+            self._ham = None
+            self._steps = None
+            self._heights = {}
 
     # def __call__(self, value):
     #     """Returns the desired row entries for the hamiltonian.
@@ -76,6 +456,141 @@ class Hamiltonian(object):
 
         return xf
 
+    def _diagonalize(self):
+        """Finds the requested eigenvalues and eigenvectors of the
+        hamiltonian. Only the upper triangle of the matrix is read.
+
+        Returns:
+            tuple of np.ndarray: The eigenvalues in ascending order and the
+              matching eigenvectors as the columns of a matrix.
+        """
+
+        ham = self.ham
+        n_basis = self.n_basis
+        n_sols = self.n_solutions
+        if n_sols is not None:
+            n_sols = min(n_sols, n_basis)
+
+        if self.storage == "structured":
+            # The operator is never expanded into a dense matrix here.
+            return self._diagonalize_preconditioned(ham.matvec,
+                                                    ham.diagonal(), n_sols,
+                                                    ham.todense)
+
+        if self.solver == "lanczos":
+            try:
+                return self._diagonalize_preconditioned(
+                    self._matmat(ham), self._diagonal(ham), n_sols,
+                    lambda: ham if self.storage != "packed" else
+                    unpack_upper(ham, symmetric=False))
+            except ImportError: # pragma: no cover
+                msg.warn("scipy is not installed; using the 'subset' "
+                         "solver instead of 'lanczos'.")
+
+        # The dense solvers need the whole matrix. LAPACK's packed drivers
+        # are not exposed by numpy or scipy, so a packed matrix is expanded
+        # into a dense work array for the solve.
+        if self.storage == "packed":
+            ham = unpack_upper(ham, symmetric=False)
+
+        if n_sols is None and self.energy_window is None:
+            return np.linalg.eigh(ham, UPLO="U")
+
+        try:
+            from scipy.linalg import eigh
+        except ImportError: # pragma: no cover
+            vals, vecs = np.linalg.eigh(ham, UPLO="U")
+            if n_sols is not None:
+                return vals[:n_sols], vecs[:,:n_sols]
+            emin, emax = self.energy_window
+            keep = (vals > emin) & (vals <= emax)
+            return vals[keep], vecs[:,keep]
+
+        if n_sols is not None:
+            return eigh(ham, lower=False, subset_by_index=[0, n_sols-1])
+        return eigh(ham, lower=False, subset_by_value=self.energy_window)
+
+    def _diagonalize_preconditioned(self, matmat, diagonal, n_sols, dense):
+        """Finds the lowest eigenstates of the hamiltonian with the locally
+        optimal block preconditioned conjugate gradient method (LOBPCG),
+        only touching the matrix through products with blocks of vectors.
+        The spectrum grows like the kinetic energy, `n^2`, so an
+        unpreconditioned iteration needs more steps the larger the basis;
+        scaling by the inverse of the diagonal removes that growth.
+
+        Args:
+            matmat (function): Multiplies the matrix with an (N, k) block.
+            diagonal (np.ndarray): The diagonal of the matrix.
+            n_sols (int): The number of lowest states to find.
+            dense (function): Returns the dense matrix; only called for
+              bases too small for the iteration.
+
+        Returns:
+            tuple of np.ndarray: The eigenvalues in ascending order and the
+              matching eigenvectors as the columns of a matrix.
+        """
+
+        from scipy.sparse.linalg import LinearOperator, lobpcg
+
+        n_basis = len(diagonal)
+        # A few extra vectors in the block speed up the convergence of the
+        # highest requested state.
+        n_block = n_sols + min(n_sols, 4)
+        if 5*n_block >= n_basis:
+            vals, vecs = np.linalg.eigh(dense(), UPLO="U")
+            return vals[:n_sols], vecs[:,:n_sols]
+
+        L = abs(self.domain[1] - self.domain[0])
+        scale = np.maximum(np.abs(diagonal), np.pi**2/L**2)
+        shape = (n_basis, n_basis)
+        A = LinearOperator(shape, matvec=matmat, matmat=matmat, dtype=float)
+        M = LinearOperator(shape, matvec=lambda v: np.ravel(v)/scale,
+                           matmat=lambda v: v/scale[:,None], dtype=float)
+        X = np.random.RandomState(0).rand(n_basis, n_block)
+        tol = max(1e-8, 100*np.finfo(float).eps*np.max(scale))
+        vals, vecs = lobpcg(A, X, M=M, tol=tol, maxiter=1000, largest=False)
+        order = np.argsort(vals)[:n_sols]
+        return vals[order], vecs[:,order]
+
+    def _matmat(self, ham):
+        """Returns a function that multiplies the stored hamiltonian with a
+        vector or an (N, k) block without copying the matrix.
+
+        Args:
+            ham (np.ndarray): The hamiltonian, as it is stored.
+        """
+
+        n_basis = self.n_basis
+        if self.storage == "packed":
+            from scipy.linalg.blas import dspmv
+            # The rows of the upper triangle are the columns of the lower
+            # triangle, which is BLAS's lower packed layout.
+            def matmat(v):
+                if v.ndim == 1:
+                    return dspmv(n_basis, 1., ham, v, lower=1)
+                return np.column_stack([dspmv(n_basis, 1., ham, column,
+                                              lower=1) for column in v.T])
+            return matmat
+        elif self.storage == "upper":
+            # The lower triangle is zero, so the transpose (a view) adds it.
+            diag = np.diag(ham).copy()
+            def matmat(v):
+                shape = (-1,) + (1,)*(v.ndim - 1)
+                return ham.dot(v) + ham.T.dot(v) - diag.reshape(shape)*v
+            return matmat
+        return ham.dot
+
+    def _diagonal(self, ham):
+        """Returns the diagonal of the stored hamiltonian.
+
+        Args:
+            ham (np.ndarray): The hamiltonian, as it is stored.
+        """
+
+        if self.storage == "packed":
+            return ham[_packed_offset(np.arange(self.n_basis), self.n_basis)]
+        return np.diag(ham).copy()
+
     def _construct_ham(self, n_basis):
         """Constructs the hamiltonian matrix for the system.
         
@@ -83,10 +598,371 @@ class Hamiltonian(object):
             n_basis (int): The number of basis functions to be used
               in the expansion.
         """
-        
-        ham = []
-        xr, width_b = self._find_xrs()
 
+        if self.storage == "structured":
+            self._ham = ToeplitzHankel(self._kinetic_diagonal(n_basis),
+                                       self._cosine_coefficients(2*n_basis))
+            return
+
+        if self.assembly in ["dst", "quadrature"]:
+            self._ham = self._assemble_cosine(n_basis)
+            return
+
+        if self._steps is None:
+            with timing.phase("find_xrs"):
+                self._steps = self._find_xrs()
+        xr, width_b = self._steps
+
+        if self.assembly == "vectorized":
+            self._ham = self._assemble_vectorized(n_basis, xr, width_b)
+        elif self.assembly == "reference":
+            self._ham = self._assemble_reference(n_basis, xr, width_b)
+
+    def _assemble_vectorized(self, n_basis, xr, b):
+        """Builds the hamiltonian matrix from broadcast `n` and `m` index
+        arrays over the upper triangle, evaluating the potential only once
+        per barrier.
+
+        Args:
+            n_basis (int): The number of basis functions to be used
+              in the expansion.
+            xr (list of float): The midpoints of the potential barriers.
+            b (list of float): The width of the potential barriers.
+
+        Returns:
+            np.ndarray: The hamiltonian matrix, stored as specified by
+              `self.storage`.
+        """
+
+        n = np.arange(1, n_basis+1)
+        none = n[:0]
+        hnn = self._potential_elements(n, none, none, xr, b)[0]
+        def upper(rows, cols):
+            return self._potential_elements(none, n[rows], n[cols], xr, b)[1]
+        return self._store_upper(self._kinetic_diagonal(n_basis) + hnn, upper)
+
+    def _assemble_cosine(self, n_basis):
+        """Builds the hamiltonian matrix from the cosine coefficients of the
+        potential. With `C_k` the cosine coefficients, the matrix element
+        between the basis functions `n` and `m` is `C_|n-m| - C_(n+m)`, so
+        only the `2*n_basis + 1` coefficients need to be integrated.
+
+        Args:
+            n_basis (int): The number of basis functions to be used
+              in the expansion.
+
+        Returns:
+            np.ndarray: The hamiltonian matrix, stored as specified by
+              `self.storage`.
+        """
+
+        C = self._cosine_coefficients(2*n_basis)
+        n = np.arange(1, n_basis+1)
+        diag = self._kinetic_diagonal(n_basis) + C[0] - C[2*n]
+        return self._store_upper(
+            diag, lambda rows, cols: C[cols - rows] - C[rows + cols + 2])
+
+    def _cosine_coefficients(self, k_max):
+        """Finds the cosine coefficients of the potential up to `k_max` with
+        the assembly method. The 'vectorized' and 'reference' methods
+        integrate the steps of the potential exactly.
+
+        Args:
+            k_max (int): The largest mode index needed.
+
+        Returns:
+            np.ndarray: The coefficients indexed by `k`.
+        """
+
+        xi, xf = self.domain
+        L = abs(xf - xi)
+        if self.assembly in ["vectorized", "reference"]:
+            if self._steps is None:
+                with timing.phase("find_xrs"):
+                    self._steps = self._find_xrs()
+            C = np.zeros(k_max+1)
+            for x, b in zip(*self._steps):
+                V = self._height(x)
+                Sp = self._sine_terms(x + b/2., k_max)
+                Sm = self._sine_terms(x - b/2., k_max)
+                C += V*(Sp[:k_max+1] - Sm[:k_max+1])
+                C[0] += V*b/L
+            return C
+
+        if self.assembly == "quadrature":
+            C = self._quadrature_coefficients(k_max, self.quad_order)
+            low = self._quadrature_coefficients(k_max, self.quad_order//2)
+            # Each matrix element is the difference of two coefficients.
+            self.quad_error = 2*float(np.max(np.abs(C - low)))
+            return C
+
+        M = self.samples
+        if M is None:
+            M = 2**int(np.ceil(np.log2(max(4096, 8*k_max))))
+        xs = xi + L*(np.arange(M) + 0.5)/M
+        return cosine_coefficients(self.pot(xs), xi, L, k_max)
+
+    def _quadrature_coefficients(self, k_max, order):
+        """Integrates the cosine coefficients of the potential with
+        Gauss-Legendre quadrature. The domain is split at the region edges
+        (and at declared steps) into panels no wider than the shortest
+        wavelength, and the potential is evaluated on the nodes of all the
+        panels at once.
+
+        Args:
+            k_max (int): The largest mode index needed.
+            order (int): The number of quadrature nodes in each panel.
+
+        Returns:
+            np.ndarray: The coefficients indexed by `k`.
+        """
+
+        xi, xf = self.domain
+        L = abs(xf - xi)
+        edges = set([xi, xf])
+        for key, function in self.pot.regions.items():
+            edges.update(e for e in key if xi < e < xf)
+            if isinstance(function, StepFunction):
+                edges.update(e for e in function.edges if xi < e < xf)
+        edges = np.array(sorted(edges))
+
+        # The shortest wavelength is 2L/k_max.
+        n_panels = np.maximum(np.ceil(np.diff(edges)*k_max/(2.*L)), 1)
+        bounds = np.concatenate([np.linspace(a, b, int(n) + 1)[:-1] for a, b, n
+                                 in zip(edges[:-1], edges[1:], n_panels)] +
+                                [edges[-1:]])
+        lefts, widths = bounds[:-1], np.diff(bounds)
+
+        nodes, weights = np.polynomial.legendre.leggauss(max(order, 1))
+        xs = (lefts[:,None] + widths[:,None]*(nodes + 1)/2.).ravel()
+        wV = (widths[:,None]*weights/2.).ravel()*self.pot(xs)/L
+
+        # The cosines are built a block of modes at a time to bound memory.
+        C = np.empty(k_max+1)
+        block = max(1, 2**22//len(xs))
+        for start in range(0, k_max+1, block):
+            k = np.arange(start, min(start + block, k_max+1))
+            C[k] = np.cos(np.outer(k, np.pi*xs/L)).dot(wV)
+        return C
+
+    def _potential_elements(self, n, ns, ms, xr, b):
+        """Finds the potential's matrix elements for the given diagonal
+        entries and strict upper triangle entries.
+
+        Args:
+            n (np.ndarray): The mode indices of the diagonal entries.
+            ns (np.ndarray): The row mode indices of the off diagonal entries.
+            ms (np.ndarray): The column mode indices of the off diagonal
+              entries; each one has to be larger than its row in `ns`.
+            xr (list of float): The midpoints of the potential barriers.
+            b (list of float): The width of the potential barriers.
+
+        Returns:
+            tuple of np.ndarray: The diagonal and the off diagonal entries.
+        """
+
+        L = abs(self.domain[1] - self.domain[0])
+        k_max = 2*max(np.max(n, initial=0), np.max(ms, initial=0))
+        diff, total = ms - ns, ms + ns
+
+        hnn = np.zeros(len(n))
+        hnm = np.zeros(len(ns))
+        used = set()
+        # The barriers are accumulated, and the sine terms combined, in the
+        # same order as `_hnn` and `_hnm` so that the result matches the
+        # reference assembly element for element.
+        for i_x in range(len(xr)):
+            V = self._height(xr[i_x])
+            spb = xr[i_x] + b[i_x]/2.
+            smb = xr[i_x] - b[i_x]/2.
+            Sp = self._sine_terms(spb, k_max)
+            Sm = self._sine_terms(smb, k_max)
+            hnn += V*((spb/L-Sp[2*n])-(smb/L-Sm[2*n]))
+            hnm += V*((Sp[diff]-Sp[total])-(Sm[diff]-Sm[total]))
+            used.update([(spb, L), (smb, L)])
+
+        # Only the sine terms of the current barriers are kept around, which
+        # bounds the cache while a parameter sweep moves the barriers.
+        self._sines = dict((key, self._sines[key]) for key in used)
+        return hnn, hnm
+
+    def extend(self, n_extra):
+        """Adds basis functions to the expansion. The matrix elements don't
+        depend on the size of the basis, so for the vectorized assembly only
+        the new rows and columns of an already assembled matrix are
+        computed; otherwise the matrix is reassembled when it is next
+        accessed. The eigenstates are always discarded.
+
+        Args:
+            n_extra (int): The number of basis functions to add.
+        """
+
+        n_old = self.n_basis
+        self.n_basis = n_old + n_extra
+        self._eigen = None
+        if self._ham is None:
+            return
+        if self.assembly != "vectorized" or self.storage == "structured":
+            self._ham = None
+            return
+
+        old = self._ham
+        if self.storage == "packed":
+            def old_entries(rows, cols):
+                return old[_packed_offset(rows, n_old) + cols - rows]
+        else:
+            def old_entries(rows, cols):
+                return old[rows, cols]
+
+        n = np.arange(1, self.n_basis+1)
+        none = n[:0]
+        if self._steps is None:
+            # A matrix loaded from the cache was never assembled here.
+            with timing.phase("find_xrs"):
+                self._steps = self._find_xrs()
+        xr, width_b = self._steps
+
+        def upper(rows, cols):
+            new = cols >= n_old
+            entries = np.empty(len(rows))
+            entries[~new] = old_entries(rows[~new], cols[~new])
+            entries[new] = self._potential_elements(
+                none, n[rows[new]], n[cols[new]], xr, width_b)[1]
+            return entries
+
+        with timing.phase("assemble"):
+            diag = self._kinetic_diagonal(self.n_basis).copy()
+            i = np.arange(n_old)
+            diag[:n_old] = old_entries(i, i)
+            diag[n_old:] += self._potential_elements(n[n_old:], none, none,
+                                                     xr, width_b)[0]
+            self._ham = self._store_upper(diag, upper)
+        if self.cache is not None:
+            self.cache.store_matrix(self, self._ham)
+
+    def converge(self, tol, n_states=None, step=None, max_basis=None):
+        """Grows the basis until the lowest eigenvalues change by no more
+        than `tol` from one size to the next.
+
+        Args:
+            tol (float): The largest change allowed in any of the eigenvalues.
+            n_states (int, optional): The number of lowest eigenvalues that
+              have to converge; defaults to all that are solved for at the
+              starting size.
+            step (int, optional): The number of basis functions added each
+              time. By default the basis is doubled.
+            max_basis (int, optional): The largest basis to try; defaults to
+              16 times the starting size. The last step is shortened to end
+              on it.
+
+        Returns:
+            bool: True if the eigenvalues converged, in which case `n_basis`
+              is the size at which they did.
+        """
+
+        if max_basis is None:
+            max_basis = 16*self.n_basis
+        previous = np.array(self.eigenvals[:n_states])
+        # Without n_solutions the number of eigenvalues grows with the
+        # basis, so only those found at the starting size are compared.
+        n_states = len(previous)
+
+        while self.n_basis < max_basis:
+            n_extra = self.n_basis if step is None else step
+            self.extend(min(n_extra, max_basis - self.n_basis))
+            current = np.array(self.eigenvals[:n_states])
+            change = np.max(np.abs(current - previous), initial=0.)
+            msg.info("N={}: the eigenvalues changed by {}.".format(
+                self.n_basis, change), 2)
+            if change <= tol:
+                return True
+            previous = current
+        return False
+
+    def _store_upper(self, diag, upper):
+        """Arranges the diagonal and strict upper triangle of the hamiltonian
+        as specified by `self.storage`. The upper triangle is filled a block
+        of rows at a time, so its index arrays and temporaries stay a small
+        fraction of the matrix.
+
+        Args:
+            diag (np.ndarray): The diagonal of the matrix.
+            upper (function): Returns the entries of the strict upper
+              triangle for arrays of (0-based) row and column indices.
+
+        Returns:
+            np.ndarray: The hamiltonian matrix.
+        """
+
+        n_basis = len(diag)
+        if self.storage == "packed":
+            ham = np.empty(n_basis*(n_basis+1)//2)
+        else:
+            ham = np.zeros((n_basis, n_basis))
+
+        step = max(1, 2**16//max(n_basis, 1))
+        columns = np.arange(n_basis)
+        for start in range(0, n_basis, step):
+            block = np.arange(start, min(start + step, n_basis))
+            # Row by row, like the packing.
+            i, cols = np.nonzero(columns > block[:,None])
+            rows = block[i]
+            entries = upper(rows, cols)
+
+            if self.storage == "packed":
+                # The rows of a block are contiguous in the packed array;
+                # the diagonal of each row comes before its other entries.
+                first = _packed_offset(block[0], n_basis)
+                segment = ham[first:_packed_offset(block[-1] + 1, n_basis)]
+                d_index = _packed_offset(block, n_basis) - first
+                off = np.ones(len(segment), dtype=bool)
+                off[d_index] = False
+                segment[off] = entries
+                segment[d_index] = diag[block]
+            else:
+                ham[rows, cols] = entries
+                if self.storage == "full":
+                    ham[cols, rows] = entries
+
+        if self.storage != "packed":
+            ham[np.diag_indices(n_basis)] = diag
+        return ham
+
+    def _kinetic_diagonal(self, n_basis):
+        """Returns the kinetic energy of the basis functions, which is the
+        diagonal of the hamiltonian without the potential. It doesn't depend
+        on the potential's parameters so it is cached until the number of
+        basis functions or the width of the domain changes.
+
+        Args:
+            n_basis (int): The number of basis functions.
+
+        Returns:
+            np.ndarray: The kinetic energy of each basis function.
+        """
+
+        L = abs(self.domain[1] - self.domain[0])
+        if self._kinetic is None or self._kinetic[0] != (n_basis, L):
+            n = np.arange(1, n_basis+1)
+            self._kinetic = ((n_basis, L), (np.pi**2)*(n**2)/(L**2))
+        return self._kinetic[1]
+
+    def _assemble_reference(self, n_basis, xr, width_b):
+        """Builds the hamiltonian matrix one element at a time using
+        `_hnn` and `_hnm`. This is slow for large `n_basis` and is kept as
+        the reference that the other assembly methods are tested against.
+
+        Args:
+            n_basis (int): The number of basis functions to be used
+              in the expansion.
+            xr (list of float): The midpoints of the potential barriers.
+            width_b (list of float): The width of the potential barriers.
+
+        Returns:
+            np.ndarray: The (n_basis, n_basis) hamiltonian matrix.
+        """
+
+        ham = []
         for n in range(n_basis):
             temp = []
             for m in range(n_basis):
@@ -101,57 +977,163 @@ class Hamiltonian(object):
                 temp.append(en+hnm)
             ham.append(temp)
 
-        self.ham = np.array(ham)
+        ham = np.array(ham)
+        if self.storage == "packed":
+            return pack_upper(ham)
+        elif self.storage == "upper":
+            return np.triu(ham)
+        return ham
                 
     def _find_xrs(self):
-        """Finds the mid points of the potential bariers.
+        """Finds the mid points of the potential bariers by splitting the
+        domain into steps of constant potential.
 
         Returns: 
             tuple of lists: The list of the barriers in the well and a list 
                 of the widths of the barriers in the well.
         """
 
+        # Piecewise constant potentials give their steps exactly.
+        steps = self.pot.steps(*self.domain)
+        if steps is not None:
+            xr = []
+            width_b = []
+            for left, right, V in steps:
+                if V != 0:
+                    xr.append((left + right)/2.)
+                    width_b.append(right - left)
+                    self._heights[xr[-1]] = V
+            return xr, width_b
+
+        xs = self._find_breakpoints()
+        mids = (xs[:-1] + xs[1:])/2.
+        Vs = self.pot(mids)
+
+        # Neighbouring steps of the same height are merged into a single
+        # barrier; steps with no potential don't contribute to the matrix.
         xr = []
         width_b = []
-        
-        # We need to find the best number of divisions for the system
-        # to make sure we aren't missing any bumps. For the average
-        # user something like 0.1 will likely suffice, however if the
-        # user does something special in their potential then we may
-        # need to use a smaller iterative size.
-        temp = []
-        for key in self.pot.params:
-            if key != '__builtins__' and key != 'operator':
-                temp.append(abs(self.pot.params[key]))
-        if min(temp) > 1:
-            divs = 0.1
-        else:
-            divs = min(temp)/10.0
+        left = 0
+        for i in range(1, len(mids)+1):
+            if i < len(mids) and Vs[i] == Vs[left]:
+                continue
+            if Vs[left] != 0:
+                xr.append((xs[left] + xs[i])/2.)
+                width_b.append(xs[i] - xs[left])
+            left = i
 
-        xs = np.arange(self.domain[0],self.domain[1]+divs,divs)
-        
-        # Now we need to scan through the potential to find the bumps.
-        Vt = [self.pot(xs[0])]
-        for x in xs:
-            if self.pot(x) > Vt[0]:
-                Vt.append(x)
-                xr.append(np.mean(Vt[1:]))
-                width_b.append(abs(Vt[-1]-Vt[1]))
-                Vt = [self.pot(x),x]
-            elif self.pot(x) < Vt[0]:
-                Vt.append(x)
-                xr.append(np.mean(Vt[1:]))
-                width_b.append(abs(Vt[-1]-Vt[1]))
-                Vt = [self.pot(x),x]
+        return xr, width_b
+
+    def _find_breakpoints(self):
+        """Finds the points in the domain where the potential changes. The
+        region edges are taken from the potential configuration; inside the
+        regions defined by functions the potential is sampled every `divs`
+        and each change is bisected down to `tol` if it is a jump. Where the
+        function varies smoothly the sample points themselves are used.
+
+        Returns:
+            np.ndarray: The sorted breakpoints, including both ends of the
+              domain.
+        """
+
+        xi, xf = self.domain
+        edges = set([xi, xf])
+        for key in self.pot.regions:
+            edges.update(e for e in key if xi < e < xf)
+        edges = sorted(edges)
+
+        xs = [edges[0]]
+        for left, right in zip(edges[:-1], edges[1:]):
+            function = self.pot.region_function((left + right)/2.)
+            if isinstance(function, StepFunction):
+                xs.extend(e for e in function.edges if left < e < right)
+            elif hasattr(function, "__call__") and right - left > 2*self.tol:
+                xs.extend(self._scan_region(left, right))
+            xs.append(right)
+
+        return np.array(xs)
+
+    def _scan_region(self, left, right):
+        """Finds the points strictly between `left` and `right` where the
+        potential changes.
+
+        Args:
+            left (float): The start of the region.
+            right (float): The end of the region.
+
+        Returns:
+            list of float: The breakpoints found inside the region.
+        """
+
+        # The step is adjusted slightly so that it divides the region evenly.
+        n_samples = max(int(round((right - left)/self.divs)), 1)
+        samples = left + (right - left)*np.arange(n_samples)/n_samples
+        # The last sample sits just inside the region so that a change right
+        # before its end is still seen.
+        samples = np.append(samples, right - self.tol)
+        Vs = self.pot(samples)
+
+        breaks = []
+        for i in np.nonzero(Vs[1:] != Vs[:-1])[0]:
+            jump = self._bisect_jump(samples[i], samples[i+1], Vs[i], Vs[i+1])
+            if jump is None:
+                breaks.extend([samples[i], samples[i+1]])
             else:
-                Vt.append(x)
+                breaks.append(jump)
 
-        if len(Vt) > 2:
-            xr.append(np.mean(Vt[1:]))
-            width_b.append(abs(Vt[-1]-Vt[1]))
+        # Breaks within `tol` of the region's end coincide with the end.
+        return sorted(x for x in set(breaks) if left < x < right - self.tol)
 
-        return xr, width_b
-        
+    def _bisect_jump(self, a, b, va, vb):
+        """Locates a jump in the potential between `a` and `b` to within
+        `tol` by bisection.
+
+        Args:
+            a (float): A point left of the jump.
+            b (float): A point right of the jump.
+            va (float): The potential at `a`.
+            vb (float): The potential at `b`.
+
+        Returns:
+            float: The location of the jump, or None if the potential takes
+              a third value between `a` and `b`, i.e. it isn't a single jump.
+        """
+
+        while b - a > self.tol:
+            c = (a + b)/2.
+            vc = self.pot(c)
+            if vc == va:
+                a = c
+            elif vc == vb:
+                b = c
+            else:
+                return None
+
+        return (a + b)/2.
+
+    def _default_divs(self):
+        """Picks the sampling step used inside the regions of the potential
+        that are defined by functions. For the average user something like
+        0.1 will likely suffice, however if the user does something special
+        in their potential then we may need to use a smaller step.
+        Tabulated potentials are sampled at their grid spacing, but with no
+        more than 4096 samples across the domain.
+        """
+
+        if isinstance(self.pot, TabulatedPotential):
+            L = abs(self.domain[1] - self.domain[0])
+            return max(self.pot.spacing, L/4096.)
+
+        temp = []
+        for key, value in self.pot.params.items():
+            if (isinstance(value, (int, float)) and not isinstance(value, bool)
+                and value != 0):
+                temp.append(abs(value))
+
+        if len(temp) == 0 or min(temp) > 1:
+            return 0.1
+        else:
+            return min(temp)/10.0
 
     def _hnn(self,n, xr, b):
         """The value of the integral over the basis functions for each x in
@@ -172,7 +1154,7 @@ class Hamiltonian(object):
         for i_x in range(len(xr)):
             spb = xr[i_x] + b[i_x]/2.
             smb = xr[i_x] - b[i_x]/2.
-            hnm += self.pot(xr[i_x])*(self._fnn(spb,n)-self._fnn(smb,n))
+            hnm += self._height(xr[i_x])*(self._fnn(spb,n)-self._fnn(smb,n))
 
         return hnm
 
@@ -195,10 +1177,41 @@ class Hamiltonian(object):
         for x_i in range(len(xr)):
             spb = xr[x_i] + b[x_i]/2.
             smb = xr[x_i] - b[x_i]/2.
-            hnm += self.pot(xr[x_i])*(self._fnm(spb,n,m)-self._fnm(smb,n,m))
+            hnm += self._height(xr[x_i])*(self._fnm(spb,n,m)-self._fnm(smb,n,m))
 
         return hnm
 
+    def _height(self, x):
+        """Returns the height of the potential barrier centered at `x`. The
+        heights are cached so that the potential is only evaluated once per
+        barrier during the assembly.
+        """
+        if x not in self._heights:
+            self._heights[x] = self.pot(x)
+        return self._heights[x]
+
+    def _sine_terms(self, x, k_max):
+        """Returns the sine integral terms `sin(k*pi*x/L)/(pi*k)` at `x` for
+        every mode index `k` up to `k_max`, out of which `_fnn` and `_fnm`
+        are built. The terms are cached for each barrier edge.
+
+        Args:
+            x (float): The barrier edge.
+            k_max (int): The largest mode index needed.
+
+        Returns:
+            np.ndarray: The terms indexed by `k`; the `k=0` entry is zero.
+        """
+
+        L = abs(self.domain[1] - self.domain[0])
+        terms = self._sines.get((x, L))
+        if terms is None or len(terms) <= k_max:
+            k = np.arange(1, k_max+1)
+            terms = np.zeros(k_max+1)
+            terms[1:] = np.sin(k*np.pi*x/L)/(np.pi*k)
+            self._sines[(x, L)] = terms
+        return terms
+
     def _fnn(self,x,n):
         L = abs(self.domain[1] - self.domain[0])
 
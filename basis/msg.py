@@ -1,7 +1,6 @@
 """This module handles writing to the terminal or a log file with support
 for coloring for warnings, errors, etc."""
 from __future__ import print_function
-from termcolor import cprint
 verbosity = None
 """The verbosity level of messages being printed by the module."""
 quiet = None
@@ -24,6 +23,13 @@ nocolor = False
 """When true, the colored outputs all use the regular print() instead 
 so that the stdout looks ordinary.
 """
+def cprint(text, color=None, **kwargs):
+    """Prints colored text using `termcolor`, which is only imported once
+    something is actually printed so that it doesn't slow down startup.
+    """
+    from termcolor import cprint as _cprint
+    _cprint(text, color, **kwargs)
+
 def example(script, explain, contents, requirements, output, outputfmt, details):
     """Prints the example help for the script."""
     blank()
@@ -0,0 +1,125 @@
+"""Methods for writing the solutions of 1D quantum potentials to file and
+reading them back.
+
+Two formats are supported:
+
+- **text** (the default): a header line followed by one line per solution
+  with the eigenvalue and then the components of its eigenvector.
+- **npz**: an uncompressed `numpy` archive with the arrays `eigenvals`,
+  `eigenvecs` (one eigenvector per *row*), `domain` and `n_basis`, plus the
+  potential's parameters and configuration file path as metadata.
+"""
+
+import json
+import numpy as np
+
+formats = ["text", "npz"]
+"""list: the available output formats.
+"""
+
+def write_solution(ham, n_solutions, outfile, fmt="text"):
+    """Writes the lowest eigenvalues and their eigenvectors to file.
+
+    Args:
+        ham (Hamiltonian): The solved system.
+        n_solutions (int): The number of solutions to be written.
+        outfile (str): The path to the desired output file.
+        fmt (str, optional): One of :data:`formats`.
+
+    Raises:
+        ValueError: if `fmt` is not a known format.
+    """
+
+    if fmt == "text":
+        write_text(ham, n_solutions, outfile)
+    elif fmt == "npz":
+        write_npz(ham, n_solutions, outfile)
+    else:
+        emsg = "'{}' is not a valid output format; use one of {}."
+        raise ValueError(emsg.format(fmt, formats))
+
+def write_text(ham, n_solutions, outfile, block_size=64):
+    """Writes the solutions in the text format. The eigenvectors are taken
+    column by column from the solution and formatted a block of solutions
+    at a time, so memory use doesn't grow with the number of solutions.
+
+    Args:
+        ham (Hamiltonian): The solved system.
+        n_solutions (int): The number of solutions to be written.
+        outfile (str): The path to the desired output file.
+        block_size (int, optional): The number of solutions formatted at a
+          time.
+    """
+
+    eigen_vals = ham.eigenvals
+    eigen_vecs = ham.eigenvecs
+    n_solutions = min(n_solutions, len(eigen_vals))
+
+    with open(outfile,"w+") as outf:
+        outf.write("Eigenval      Eigenvec\n")
+
+        for start in range(0, n_solutions, block_size):
+            stop = min(start + block_size, n_solutions)
+            vals = eigen_vals[start:stop].tolist()
+            vecs = np.transpose(eigen_vecs[:,start:stop]).tolist()
+            outf.writelines(_text_line(val, vec) for val, vec in zip(vals, vecs))
+
+def _text_line(val, vec):
+    """Formats a single solution as a line of the text format; `repr` gives
+    the shortest string that reads back as the same float.
+    """
+    return "{}       {}\n".format(repr(val), " ".join(map(repr, vec)))
+
+def write_npz(ham, n_solutions, outfile):
+    """Writes the solutions in the binary npz format. The archive is not
+    compressed so that its arrays can be memory-mapped.
+
+    Args:
+        ham (Hamiltonian): The solved system.
+        n_solutions (int): The number of solutions to be written.
+        outfile (str): The path to the desired output file; it is used as is,
+          without adding an `.npz` extension.
+    """
+
+    n_solutions = min(n_solutions, len(ham.eigenvals))
+    params = dict((k, v) for k, v in ham.pot.params.items()
+                  if isinstance(v, (int, float, str)))
+
+    # Passing an open file stops numpy from appending '.npz' to the name.
+    with open(outfile, "wb") as outf:
+        np.savez(outf, eigenvals=ham.eigenvals[:n_solutions],
+                 eigenvecs=np.ascontiguousarray(
+                     np.transpose(ham.eigenvecs[:,:n_solutions])),
+                 domain=np.array(ham.domain, dtype=float),
+                 n_basis=np.array(ham.n_basis),
+                 params=np.array(json.dumps(params, sort_keys=True)),
+                 potcfg=np.array(ham.pot.filepath or ""))
+
+def load_solution(filepath):
+    """Reads a solution written by :func:`write_solution` in either format.
+
+    Args:
+        filepath (str): The path to the solution file.
+
+    Returns:
+        dict: with keys `eigenvals`, `eigenvecs` (one eigenvector per row),
+          `domain`, `n_basis`, `params` and `potcfg`. The text format only
+          stores the eigenstates, so the other entries are None for it.
+    """
+
+    with open(filepath, "rb") as f:
+        is_npz = f.read(4) == b"PK\x03\x04"
+
+    if is_npz:
+        with np.load(filepath) as data:
+            return {"eigenvals": data["eigenvals"],
+                    "eigenvecs": data["eigenvecs"],
+                    "domain": list(data["domain"]),
+                    "n_basis": int(data["n_basis"]),
+                    "params": json.loads(str(data["params"])),
+                    "potcfg": str(data["potcfg"])}
+
+    table = np.loadtxt(filepath, skiprows=1, ndmin=2)
+    return {"eigenvals": table[:,0], "eigenvecs": table[:,1:],
+            "domain": None, "n_basis": table.shape[1] - 1, "params": None,
+            "potcfg": None}
@@ -1,8 +1,150 @@
 """Defines a class and methods for evaluating 1D quantum potentials.
 """
 
+import hashlib
+import json
 import numpy as np
-from basis import msg
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from basis import msg, timing
+
+expression_builtins = ["abs", "bool", "divmod", "float", "int", "len", "max",
+                       "min", "pow", "range", "round", "sum"]
+"""list: the builtin functions that the expressions in potential
+configuration files can use.
+"""
+expression_functions = {
+    "numpy": ["abs", "arccos", "arcsin", "arctan", "arctan2", "ceil", "clip",
+              "cos", "cosh", "e", "exp", "floor", "fmod", "heaviside",
+              "hypot", "log", "log10", "maximum", "minimum", "mod", "pi",
+              "power", "sign", "sin", "sinh", "sqrt", "tan", "tanh",
+              "where"],
+    "operator": ["abs", "add", "eq", "floordiv", "ge", "gt", "le", "lt",
+                 "mod", "mul", "ne", "neg", "pos", "pow", "sub", "truediv"],
+    "math": ["acos", "asin", "atan", "atan2", "ceil", "cos", "cosh", "e",
+             "exp", "fabs", "floor", "fmod", "hypot", "log", "log10", "pi",
+             "pow", "sin", "sinh", "sqrt", "tan", "tanh"],
+    }
+"""dict: keys are the module names that the expressions in potential
+configuration files can use; values are the functions and constants of
+each module that they can reach.
+"""
+_compiled = OrderedDict()
+"""OrderedDict: compiled region expressions, keyed by the hash of the
+[regions] section that they were compiled from, with the most recently used
+last.
+"""
+_compiled_size = 64
+"""int: the number of compiled [regions] sections that are kept.
+"""
+
+def _namespace():
+    """Returns the restricted namespace that the expressions of potential
+    configuration files are evaluated in. It keeps honest configuration
+    files from reaching the file system by accident; it is not a sandbox
+    for untrusted files.
+    """
+    import math
+    import operator
+    import builtins
+    from types import SimpleNamespace
+    namespace = {"__builtins__": dict((name, getattr(builtins, name))
+                                      for name in expression_builtins)}
+    for module in [np, operator, math]:
+        name = "numpy" if module is np else module.__name__
+        namespace[name] = SimpleNamespace(**dict(
+            (attr, getattr(module, attr))
+            for attr in expression_functions[name]))
+    return namespace
+
+def _code_names(code):
+    """Returns the global and attribute names and the string constants used
+    by a code object and the functions defined in it.
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, "co_names"):
+            names |= _code_names(const)
+        elif isinstance(const, str):
+            names.add(const)
+    return names
+
+def _compile_expression(source, filepath):
+    """Compiles an expression from a potential configuration file.
+
+    Args:
+        source (str): the expression.
+        filepath (str): the file it is from, for the error messages.
+
+    Returns:
+        tuple: the code object and the set of names it uses.
+
+    Raises:
+        ValueError: if the expression uses a name that starts with an
+          underscore or a string with a double underscore, which could reach
+          outside of the restricted namespace.
+    """
+    code = compile(source.strip(), filepath, "eval")
+    names = _code_names(code)
+    hidden = sorted(name for name in names
+                    if name.startswith("_") or "__" in name)
+    if hidden:
+        emsg = "'{}' in '{}' uses {}, which isn't allowed."
+        raise ValueError(emsg.format(source.strip(), filepath, hidden))
+    return code, names
+
+class StepFunction(object):
+    """A piecewise constant function, which is how a region of a potential
+    configuration file declares that it is made of steps: its value is a
+    list of `(start, end, height)` tuples, e.g. for a Kronig-Penney lattice
+
+        1 = 0, n*w | [(i*w, i*w + w - s, v0) for i in range(n)]
+
+    The function is zero between and outside of the steps, and the steps
+    are used as they are by :class:`basis.hamiltonian.Hamiltonian` instead
+    of being found by sampling.
+
+    Args:
+        steps (list of tuple): the `(start, end, height)` of each step.
+
+    Attributes:
+        edges (numpy.ndarray): the sorted edges of the steps.
+        heights (numpy.ndarray): the height between each pair of
+          consecutive edges.
+
+    Raises:
+        ValueError: if any of the steps overlap.
+    """
+
+    def __init__(self, steps):
+        steps = sorted((float(a), float(b), float(h)) for a, b, h in steps
+                       if a < b)
+        for left, right in zip(steps[:-1], steps[1:]):
+            if right[0] < left[1]:
+                emsg = "The steps {} and {} overlap."
+                raise ValueError(emsg.format(left, right))
+
+        edges = sorted(set(e for a, b, h in steps for e in (a, b)))
+        heights = np.zeros(max(len(edges) - 1, 0))
+        for a, b, h in steps:
+            heights[bisect_left(edges, a):bisect_left(edges, b)] = h
+        self.edges = np.array(edges)
+        self.heights = heights
+
+    def __call__(self, x):
+        i = np.searchsorted(self.edges, x, side="right") - 1
+        # Values outside of the steps look up the zero appended at the end.
+        n = len(self.heights)
+        V = np.append(self.heights, 0.)[np.where((i < 0) | (i >= n), n, i)]
+        return V if np.ndim(x) else float(V)
+
+def _region_value(value):
+    """Converts the value of a region's expression; lists of steps become
+    a :class:`StepFunction`.
+    """
+    if isinstance(value, (list, tuple)):
+        return StepFunction(value)
+    return value
 
 class Potential(object):
     """Represnts a 1D quantum potential.
@@ -35,6 +177,10 @@ class Potential(object):
         self.params = {}
         self.regions = {}
         self.parser = None
+        self._edges = []
+        self._owners = np.array([], dtype=int)
+        self._keys = []
+        self._array_safe = {}
 
         self._parse_config()
 
@@ -59,22 +205,132 @@ class Potential(object):
             ValueError: if the argument is not an `int` of `float`.
         """
 
+        if timing.counting:
+            timing.count("potential_calls")
+            timing.count("potential_points", np.size(value))
         if isinstance(value, list) or isinstance(value, np.ndarray):
-            return np.array(list(map(self, value)))
+            return self._evaluate_array(value)
 
         if not isinstance(value, (int,float)):
             raise ValueError("Only `int` and `float` values con be "
                              "evaluated by the potential.")
-        
-        for xi, xf in self.regions:
-            if value >= xi and value < xf:
-                function = self.regions[(xi, xf)]
-                if hasattr(function, "__call__"):
-                    return function(value)
-                else:
-                    return function
-        else:
+
+        function = self.region_function(value)
+        if function is None:
             return 0.
+        elif hasattr(function, "__call__"):
+            return function(value)
+        else:
+            return function
+
+    def region_function(self, x):
+        """Returns the function or value of the region that contains `x`,
+        found by a binary search over the sorted region edges.
+
+        Args:
+            x (float): the position.
+
+        Returns:
+            the region's function or value, or None if `x` is outside all
+            the regions.
+        """
+        i = bisect_right(self._edges, x) - 1
+        if 0 <= i < len(self._owners) and self._owners[i] >= 0:
+            return self.regions[self._keys[self._owners[i]]]
+
+    def _evaluate_array(self, value):
+        """Evaluates the potential for an array of values by looking up the
+        region of every value at once and calling each region's function on
+        all of its values together.
+
+        Args:
+            value (numpy.ndarray or list): where to evaluate.
+
+        Returns:
+            numpy.ndarray: potential evaluated at `value`.
+
+        Raises:
+            ValueError: if `value` can't be converted to an array of floats.
+        """
+
+        try:
+            x = np.asarray(value, dtype=float)
+        except (TypeError, ValueError):
+            raise ValueError("Only `int` and `float` values con be "
+                             "evaluated by the potential.")
+
+        flat = x.ravel()
+        result = np.zeros(flat.shape)
+        if len(self._edges) < 2:
+            return result.reshape(x.shape)
+
+        # The edges split the axis into intervals that each belong to (at
+        # most) one region; values outside every region stay at zero.
+        interval = np.searchsorted(self._edges, flat, side="right") - 1
+        inside = (interval >= 0) & (interval < len(self._owners))
+        owners = np.full(flat.shape, -1)
+        owners[inside] = self._owners[interval[inside]]
+
+        for ikey in np.unique(owners[owners >= 0]):
+            mask = owners == ikey
+            result[mask] = self._evaluate_region(self._keys[ikey], flat[mask])
+
+        return result.reshape(x.shape)
+
+    def _evaluate_region(self, key, x):
+        """Evaluates the function of a single region on an array of values.
+        Functions that don't work on arrays (such as those with `if`
+        statements) are evaluated one value at a time instead.
+
+        Args:
+            key (tuple): the (start, end) key of the region in `regions`.
+            x (numpy.ndarray): 1D array of values inside the region.
+
+        Returns:
+            numpy.ndarray or float: the potential in the region.
+        """
+
+        function = self.regions[key]
+        if not hasattr(function, "__call__"):
+            return function
+
+        if self._array_safe.get(key, True):
+            try:
+                V = np.asarray(function(x), dtype=float)
+            except (TypeError, ValueError):
+                V = None
+            if V is not None and V.shape == x.shape:
+                self._array_safe[key] = True
+                return V
+            self._array_safe[key] = False
+
+        return np.vectorize(function, otypes=[float])(x)
+
+    def _index_regions(self):
+        """Sorts the region edges so that the region of a value can be found
+        with a binary search over the intervals between consecutive edges.
+
+        Raises:
+            ValueError: if any two regions overlap.
+        """
+
+        # Empty (or inverted) regions never contain a value.
+        keys = sorted((key for key in self.regions if key[0] < key[1]),
+                      key=lambda key: key[0])
+        for left, right in zip(keys[:-1], keys[1:]):
+            if right[0] < left[1]:
+                emsg = "The regions {} and {} in '{}' overlap."
+                raise ValueError(emsg.format(left, right, self.filepath))
+
+        edges = sorted(set(e for key in keys for e in key))
+        owners = np.full(max(len(edges) - 1, 0), -1, dtype=int)
+        for ikey, (xi, xf) in enumerate(keys):
+            owners[bisect_left(edges, xi):bisect_left(edges, xf)] = ikey
+
+        self._keys = keys
+        self._edges = edges
+        self._owners = owners
+        self._array_safe = {}
 
     def _parse_params(self):
         """Extracts the potential parameters from the specified config
@@ -83,32 +339,97 @@ class Potential(object):
 
         if self.parser.has_section("parameters"):
             for param, sval in self.parser.items("parameters"):
-                self.params[param] = eval(sval)
+                code, names = _compile_expression(sval, self.filepath)
+                self.params[param] = eval(code, _namespace())
+
+    def _compile_regions(self):
+        """Compiles the domain and function expressions of the regions, or
+        returns them from the cache of compiled files.
+
+        Returns:
+            list of tuple: (domain code, domain names, function code,
+              function names) for each region, where the names are those
+              the expression looks up.
+        """
+
+        specs = self.parser.items("regions")
+        key = hashlib.sha256(json.dumps(specs).encode("utf-8")).hexdigest()
+        if key in _compiled:
+            _compiled.move_to_end(key)
+            return _compiled[key]
+
+        compiled = []
+        for i, spec in specs:
+            domain, sfunc = spec.split('|')
+            compiled.append(_compile_expression(domain, self.filepath) +
+                            _compile_expression(sfunc, self.filepath))
+        _compiled[key] = compiled
+        while len(_compiled) > _compiled_size:
+            _compiled.popitem(last=False)
+        return compiled
 
     def _parse_regions(self):
         """Parses the potential configuration file to initialize the 
-        parameters and function call.
+        parameters and function call. The expressions are evaluated in a
+        namespace with only the parameters, :data:`expression_builtins`
+        and the :data:`expression_functions` of the `numpy`, `operator`
+        and `math` modules.
+
+        Raises:
+            ValueError: if [regions] is missing, or if any of the regions
+              overlap or are repeated.
         """
         
         if not self.parser.has_section("regions"):
             raise ValueError("[regions] is required to define a "
                              "potential.")
 
+        self._globals = _namespace()
+        self._globals.update(self.params)
+        self._bindings = []
+        for dcode, dnames, fcode, fnames in self._compile_regions():
+            domain = tuple(eval(dcode, self._globals))
+            self._bindings.append([dcode, dnames, fcode, fnames, domain,
+                                   _region_value(eval(fcode, self._globals))])
+
+        self._set_regions()
+
+    def _set_regions(self):
+        """Builds the regions from the evaluated expressions.
+
+        Raises:
+            ValueError: if any of the regions overlap or are repeated.
+        """
+
         self.regions = {}
-        
-        for i, spec in self.parser.items("regions"):
-            domain, sfunc = spec.split('|')
-            if "numpy" in sfunc:
-                import numpy as np
-                self.params["numpy"] = np
-
-            if "operator" in sfunc:
-                import operator
-                self.params["operator"] = operator
-                
-            xi, xf = eval(domain, self.params)
-            function = eval(sfunc, self.params)
-            self.regions[(xi, xf)] = function
+        for binding in self._bindings:
+            domain, function = binding[4:]
+            if domain in self.regions:
+                emsg = "The region {} is defined more than once in '{}'."
+                raise ValueError(emsg.format(domain, self.filepath))
+            self.regions[domain] = function
+
+        self._index_regions()
+
+    def _rebind(self, changed):
+        """Re-evaluates only the region expressions that use one of the
+        changed parameters; the compiled code is reused.
+
+        Args:
+            changed (set): the names of the parameters that changed.
+        """
+
+        self._globals.update((k, self.params[k]) for k in changed)
+        for binding in self._bindings:
+            dcode, dnames, fcode, fnames = binding[:4]
+            if dnames & changed:
+                binding[4] = tuple(eval(dcode, self._globals))
+            # Functions look the parameters up when they are called, but
+            # constant regions (and default arguments) hold their values.
+            if fnames & changed:
+                binding[5] = _region_value(eval(fcode, self._globals))
+
+        self._set_regions()
         
     def _parse_config(self):
         """Parses the potential configuration file to initialize the 
@@ -120,26 +441,288 @@ class Potential(object):
         except ImportError: # pragma: no cover
             from configparser import ConfigParser
 
-        self.parser = ConfigParser()
-        with open(self.filepath) as f:
-            self.parser.readfp(f)
+        with timing.phase("parse"):
+            self.parser = ConfigParser()
+            with open(self.filepath) as f:
+                self.parser.readfp(f)
 
-        self._parse_params()
-        self._parse_regions()
+            self._parse_params()
+            self._parse_regions()
         
 
+    def steps(self, xi, xf):
+        """Returns the exact steps of the potential between `xi` and `xf` if
+        it is piecewise constant there, i.e. every region in between has a
+        constant value or a list of steps (see :class:`StepFunction`).
+
+        Args:
+            xi (float): The left edge.
+            xf (float): The right edge.
+
+        Returns:
+            list of tuple: the `(start, end, height)` of each step, with
+              neighbouring steps of the same height merged, covering `xi` to
+              `xf`; or None if a region in between is defined by another
+              kind of function.
+        """
+
+        edges = [xi] + [e for e in self._edges if xi < e < xf] + [xf]
+        steps = []
+        for left, right in zip(edges[:-1], edges[1:]):
+            function = self.region_function(left)
+            if function is None:
+                function = 0.
+
+            if isinstance(function, StepFunction):
+                inner = [left] + [float(e) for e in function.edges
+                                  if left < e < right] + [right]
+                for a, b in zip(inner[:-1], inner[1:]):
+                    steps.append((a, b, function((a + b)/2.)))
+            elif hasattr(function, "__call__"):
+                return None
+            else:
+                steps.append((left, right, float(function)))
+
+        merged = []
+        for a, b, h in steps:
+            if merged and merged[-1][2] == h:
+                merged[-1] = (merged[-1][0], b, h)
+            else:
+                merged.append((a, b, h))
+        return merged
+
+    def fingerprint(self):
+        """Returns a hash that identifies the potential: the region
+        definitions from the configuration file together with the current
+        values of the parameters. Two potentials with the same fingerprint
+        evaluate identically.
+
+        Returns:
+            str: the hex digest of the hash.
+        """
+
+        import hashlib
+        import json
+        regions = [spec for i, spec in self.parser.items("regions")]
+        digest = hashlib.sha256(json.dumps(regions).encode("utf-8"))
+        for name in sorted(self.params):
+            value = self.params[name]
+            # The repr of a large array is abbreviated, so arrays are hashed
+            # by their contents.
+            if isinstance(value, np.ndarray):
+                value = (value.dtype.str, value.shape, value.tobytes())
+            digest.update(repr((name, value)).encode("utf-8"))
+        return digest.hexdigest()
+
     def adjust_potential(self, **kwargs):
-        """Adjusts the parameters of the potential.
+        """Adjusts the parameters of the potential. Only the regions whose
+        expressions use one of the changed parameters are re-evaluated.
         
         Args:
             kwargs (dict): parameters and values to overwrite.
         """
+        changed = set()
         for k, v in kwargs.items():
             if k in self.params:
+                old = self.params[k]
+                if type(v) != type(old) or not np.array_equal(v, old):
+                    changed.add(k)
                 self.params[k] = v
             else:
                 wmsg = "'{}' is nat a valid parameter for '{}',"
                 msg.warn(wmsg.format(k,self.filepath))
 
+        if changed:
+            self._rebind(changed)
+
+
+table_formats = [".npy", ".npz", ".csv", ".txt", ".dat"]
+"""list: the file extensions that :func:`load_potential` reads as tabulated
+potentials; any other file is read as a potential configuration file.
+"""
+interpolations = ["linear", "nearest"]
+"""list: the ways a tabulated potential is interpolated between its samples.
+"""
+
+class TabulatedPotential(Potential):
+    """Represents a 1D quantum potential given by its values on a grid, for
+    example the output of another simulation. The potential is interpolated
+    between the grid points with array operations and is zero outside the
+    grid. Large grids can be memory-mapped, see :func:`read_table`.
+
+    Args:
+        x (numpy.ndarray): the strictly increasing grid points.
+        V (numpy.ndarray): the potential at each grid point.
+        kind (str, optional): how the potential is interpolated; one of
+          :data:`interpolations`.
+        filepath (str, optional): path to the file the table was read from.
+
+    Attributes:
+        x (numpy.ndarray): the grid points.
+        V (numpy.ndarray): the potential at each grid point.
+        kind (str): how the potential is interpolated.
+        spacing (float): the median spacing of the grid points.
+        filepath (str): absolute path to the file the table was read from,
+          or None.
+        params (dict): always empty; tabulated potentials have no parameters.
+        regions (dict): a single region spanning the grid whose value is the
+          interpolating function.
+
+    Examples:
+        >>> from basis.potential import TabulatedPotential
+        >>> import numpy as np
+        >>> x = np.linspace(-2,2,10001)
+        >>> pot = TabulatedPotential(x, 15*x**2)
+        >>> V = pot([0.5, 1.5])
+    """
+
+    def __init__(self, x, V, kind="linear", filepath=None):
+        from os import path
+        if kind not in interpolations:
+            emsg = "'{}' is not a valid interpolation; use one of {}."
+            raise ValueError(emsg.format(kind, interpolations))
+        if len(x) != len(V) or len(x) < 2:
+            raise ValueError("A tabulated potential needs at least two grid "
+                             "points and one value for each.")
+        if not np.all(np.diff(x) > 0):
+            raise ValueError("The grid points of a tabulated potential have "
+                             "to be strictly increasing.")
+
+        self.x = x
+        self.V = V
+        self.kind = kind
+        self.spacing = float(np.median(np.diff(x)))
+        self.filepath = None
+        if filepath is not None:
+            self.filepath = path.abspath(path.expanduser(filepath))
+        self.params = {}
+        self.parser = None
         self._parse_regions()
 
+    def __call__(self, value):
+        """Evaluates the potential for the given value(s).
+
+        Args:
+            value (numpy.ndarray or float): where to evaluate.
+
+        Returns:
+            numpy.ndarray or float: potential evaluated at `value`.
+
+        Raises:
+            ValueError: if the argument is not an `int` or `float`.
+        """
+
+        if timing.counting:
+            timing.count("potential_calls")
+            timing.count("potential_points", np.size(value))
+        if isinstance(value, list) or isinstance(value, np.ndarray):
+            try:
+                x = np.asarray(value, dtype=float)
+            except (TypeError, ValueError):
+                raise ValueError("Only `int` and `float` values con be "
+                                 "evaluated by the potential.")
+            return self._interpolate(x)
+
+        if not isinstance(value, (int,float)):
+            raise ValueError("Only `int` and `float` values con be "
+                             "evaluated by the potential.")
+        return float(self._interpolate(value))
+
+    def _interpolate(self, x):
+        """Interpolates the table at `x`; zero outside the grid.
+        """
+
+        if self.kind == "linear":
+            return np.interp(x, self.x, self.V, left=0., right=0.)
+
+        x = np.asarray(x, dtype=float)
+        mids = (self.x[1:] + self.x[:-1])/2.
+        V = np.asarray(self.V)[np.searchsorted(mids, x)]
+        return np.where((x < self.x[0]) | (x > self.x[-1]), 0., V)
+
+    def _parse_regions(self):
+        """Sets up the single region that spans the grid.
+        """
+
+        self.regions = {(float(self.x[0]), float(self.x[-1])): self._interpolate}
+        self._index_regions()
+
+    def fingerprint(self):
+        """Returns a hash of the grid, the values and the interpolation.
+
+        Returns:
+            str: the hex digest of the hash.
+        """
+
+        import hashlib
+        digest = hashlib.sha256(self.kind.encode("utf-8"))
+        for array in [self.x, self.V]:
+            digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+        return digest.hexdigest()
+
+def read_table(filepath, kind="linear", mmap=True):
+    """Reads a tabulated potential from file.
+
+    Args:
+        filepath (str): path to the table. `.npy` files hold a (n, 2) or
+          (2, n) array of the grid points and values; `.npz` archives hold
+          them in the arrays `x` and `V`; any other file is read as text with
+          the grid points and values in the first two columns, separated by
+          commas for `.csv` files and whitespace otherwise. Comment lines
+          start with `#`.
+        kind (str, optional): how the potential is interpolated; one of
+          :data:`interpolations`.
+        mmap (bool, optional): when True, binary tables are memory-mapped
+          instead of read into memory.
+
+    Returns:
+        TabulatedPotential: the potential.
+
+    Raises:
+        ValueError: if the table doesn't have two columns.
+    """
+
+    from os import path
+    ext = path.splitext(filepath)[1].lower()
+    if ext == ".npz":
+        from basis.reader import _array_offsets, _map_array
+        if mmap:
+            offsets = _array_offsets(filepath)
+            if offsets.get("x") is not None and offsets.get("V") is not None:
+                return TabulatedPotential(_map_array(filepath, offsets["x"]),
+                                          _map_array(filepath, offsets["V"]),
+                                          kind, filepath)
+        with np.load(filepath) as data:
+            return TabulatedPotential(data["x"], data["V"], kind, filepath)
+
+    if ext == ".npy":
+        table = np.load(filepath, mmap_mode="r" if mmap else None)
+    else:
+        table = np.loadtxt(filepath, delimiter="," if ext == ".csv" else None,
+                           ndmin=2)
+
+    if table.ndim == 2 and table.shape[1] == 2:
+        return TabulatedPotential(table[:,0], table[:,1], kind, filepath)
+    elif table.ndim == 2 and table.shape[0] == 2:
+        return TabulatedPotential(table[0], table[1], kind, filepath)
+
+    emsg = "The table in '{}' needs two columns (x and V), not shape {}."
+    raise ValueError(emsg.format(filepath, table.shape))
+
+def load_potential(filepath):
+    """Reads a potential from file; tables with one of the extensions in
+    :data:`table_formats` are read with :func:`read_table` and any other
+    file as a potential configuration file.
+
+    Args:
+        filepath (str): path to the potential.
+
+    Returns:
+        Potential: the potential.
+    """
+
+    from os import path
+    if path.splitext(filepath)[1].lower() in table_formats:
+        with timing.phase("parse"):
+            return read_table(filepath)
+    return Potential(filepath)
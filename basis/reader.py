@@ -0,0 +1,159 @@
+"""Lazy, memory-mapped access to binary solution files written by
+:func:`basis.output.write_npz`.
+"""
+
+import json
+import struct
+import zipfile
+import numpy as np
+
+class SolutionReader(object):
+    """Reads a binary (npz) solution file without loading it into memory.
+    The eigenvalues and eigenvectors are memory-mapped straight out of the
+    archive, so only the bytes that are actually used get read from disk.
+
+    Args:
+        filepath (str): path to the binary solution file.
+
+    Attributes:
+        filepath (str): absolute path to the solution file.
+        eigenvals (np.memmap): read-only view of the eigenvalues.
+        eigenvecs (np.memmap): read-only view of the eigenvectors, one per
+          row.
+        domain (list): The region over which the potential is defined.
+        n_basis (int): The number of basis functions in the expansion.
+        params (dict): The parameters of the potential that was solved.
+        potcfg (str): path to the potential configuration file.
+
+    Examples:
+        >>> from basis.reader import SolutionReader
+        >>> sol = SolutionReader("output_1.npz")
+        >>> ground = sol.eigenvals[0]
+        >>> psi = sol.eigenvec(3)
+    """
+
+    def __init__(self, filepath):
+        from os import path
+        self.filepath = path.abspath(path.expanduser(filepath))
+        self._offsets = _array_offsets(self.filepath)
+        self._arrays = {}
+
+    def _array(self, name):
+        """Returns the named array of the archive, memory-mapping it the
+        first time it is requested.
+        """
+        if name not in self._arrays:
+            self._arrays[name] = _map_array(self.filepath, self._offsets[name])
+        return self._arrays[name]
+
+    @property
+    def eigenvals(self):
+        return self._array("eigenvals")
+
+    @property
+    def eigenvecs(self):
+        return self._array("eigenvecs")
+
+    def eigenvec(self, i):
+        """Returns a read-only view of the `i`th eigenvector.
+        """
+        return self.eigenvecs[i]
+
+    @property
+    def domain(self):
+        return [float(x) for x in self._array("domain")]
+
+    @property
+    def n_basis(self):
+        return int(self._array("n_basis"))
+
+    @property
+    def params(self):
+        return json.loads(str(self._array("params")))
+
+    @property
+    def potcfg(self):
+        return str(self._array("potcfg"))
+
+def spectra(filepaths):
+    """Returns memory-mapped views of the eigenvalues in each of the given
+    binary solution files, e.g. for plotting the spectrum across a sweep.
+
+    Args:
+        filepaths (list of str): paths to the binary solution files.
+
+    Returns:
+        list of np.memmap: the eigenvalues of each file.
+    """
+    return [SolutionReader(filepath).eigenvals for filepath in filepaths]
+
+def _array_offsets(filepath):
+    """Finds where the data of each array in an npz archive starts.
+
+    Args:
+        filepath (str): path to the npz archive.
+
+    Returns:
+        dict: keys are the array names; values are (offset, dtype, shape,
+          fortran_order) tuples, or None for arrays that are compressed and
+          can't be mapped.
+
+    Raises:
+        ValueError: if the file is not an npz archive.
+    """
+
+    if not zipfile.is_zipfile(filepath):
+        emsg = ("'{}' is not a binary solution file; use "
+                "basis.output.load_solution for text files.")
+        raise ValueError(emsg.format(filepath))
+
+    offsets = {}
+    with zipfile.ZipFile(filepath) as archive, open(filepath, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename
+            if name.endswith(".npy"):
+                name = name[:-4]
+            if info.compress_type != zipfile.ZIP_STORED:
+                offsets[name] = None
+                continue
+
+            # The local file header is 30 bytes followed by the file name and
+            # an extra field whose lengths are stored at bytes 26-29.
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_len, extra_len = struct.unpack("<HH", header[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            offsets[name] = (f.tell(), dtype, shape, fortran)
+
+    return offsets
+
+def _map_array(filepath, location):
+    """Memory-maps a single array of an npz archive.
+
+    Args:
+        filepath (str): path to the npz archive.
+        location (tuple): the (offset, dtype, shape, fortran_order) of the
+          array from :func:`_array_offsets`.
+
+    Returns:
+        np.ndarray: a read-only view of the array.
+
+    Raises:
+        ValueError: if the array is compressed (`location` is None).
+    """
+
+    if location is None:
+        raise ValueError("Compressed archives can't be memory-mapped; use "
+                         "basis.output.load_solution instead.")
+
+    offset, dtype, shape, fortran = location
+    if int(np.prod(shape)) == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(filepath, dtype=dtype, mode="r", offset=offset,
+                     shape=shape, order="F" if fortran else "C")
@@ -1,10 +1,93 @@
 #!/usr/bin/python
-from basis import msg
-from basis.hamiltonian import Hamiltonian
+from basis import msg, timing
+from basis.hamiltonian import Hamiltonian, assembly_methods
+from basis.output import write_solution, formats
+from basis.wavefunction import psi
 import numpy as np
-import matplotlib.pyplot as plt
 
-def _solve_system(potcfg, n_basis, n_solutions, xl = None, xr = None, plot_f = None, outfile=None):
+def _sweep_outfile(outfile, index):
+    """Returns the output file name for a point of a sweep; the 1-based
+    `index` is appended to the name, e.g. `output.dat` -> `output_3.dat`.
+    """
+    from os import path
+    root, ext = path.splitext(outfile)
+    return "{}_{}{}".format(root, index, ext)
+
+def _get_cache(args):
+    """Returns the on-disk cache to use for the solve, or None. The cache is
+    opt-in: it is used when a directory is given with `-cache` or by the
+    `BASIS_CACHE` environment variable, unless `-no-cache` is specified.
+    """
+    import os
+    directory = args["cache"] or os.environ.get("BASIS_CACHE")
+    if args["no_cache"] or not directory:
+        return None
+
+    from basis.cache import SolutionCache
+    return SolutionCache(directory)
+
+def _sweep_system(potcfg, n_basis, n_solutions, sweep_specs, xl = None,
+                  xr = None, outfile = None, workers = None, resume = False,
+                  fmt = "text", cache = None, assembly = None):
+    """Solves the system at every point of a sweep over the potential's
+    parameters. Each point's solution is written to its own file, named by
+    :func:`_sweep_outfile`.
+
+    Args:
+        potcfg (str): The path to the `pot.cfg` file.
+        n_basis (int): The number of basis functions to use in the solution.
+        n_solutions (int): The number of solutions to be returned.
+        sweep_specs (list of str): The parameter ranges to sweep over, see
+            :func:`basis.sweep.parse_sweep`.
+        xl (float, optional): The left most edge of the potential if different 
+            from that stored in the `pot.cfg` file.
+        xr (float, optional): The right most edge of the potential if different 
+            from that stored in the `pot.cfg` file.
+        outfile (str, optional): The path to the desired output file.
+        workers (int, optional): When more than 1, the points are solved
+            independently on this many worker processes (see
+            :mod:`basis.batch`) instead of reusing one hamiltonian.
+        resume (bool, optional): When True, points whose output file already
+            exists are skipped.
+        fmt (str, optional): The output format, see :mod:`basis.output`.
+        cache (SolutionCache, optional): The on-disk cache of solutions.
+        assembly (str, optional): How the hamiltonian matrix is built, see
+            :class:`basis.hamiltonian.Hamiltonian`.
+
+    Returns:
+        list of tuple: (params, outfile) for each point of the sweep.
+    """
+
+    from basis.sweep import parse_sweep, sweep_grid, sweep
+    from os import path
+    grid = sweep_grid(parse_sweep(sweep_specs))
+
+    if workers is not None and workers > 1:
+        from basis.batch import run_batch
+        specs = [dict(potcfg=potcfg, n_basis=n_basis, n_solutions=n_solutions,
+                      xi=xl, xf=xr, params=params, format=fmt,
+                      options=dict(cache=cache, assembly=assembly),
+                      outfile=_sweep_outfile(outfile, i+1))
+                 for i, params in enumerate(grid)]
+        run_batch(specs, max_workers=workers, resume=resume)
+        return [(spec["params"], spec["outfile"]) for spec in specs]
+
+    written = []
+    points = sweep(potcfg, n_basis, grid, xl, xr, n_solutions=n_solutions,
+                   cache=cache, assembly=assembly)
+    for i, (params, ham) in enumerate(points):
+        point_file = _sweep_outfile(outfile, i+1)
+        written.append((params, point_file))
+        if resume and path.isfile(point_file):
+            continue
+        write_solution(ham, n_solutions, point_file, fmt)
+        msg.info("Solved {} -> {}".format(params, point_file), 2)
+
+    return written
+
+def _solve_system(potcfg, n_basis, n_solutions, xl = None, xr = None, plot_f = None, outfile=None,
+                  fmt = "text", cache = None, converge = None, max_basis = None,
+                  assembly = None):
     """Solves the system for the given potential and the desired number of
     basis functions. Output is written to file.
 
@@ -18,48 +101,59 @@ def _solve_system(potcfg, n_basis, n_solutions, xl = None, xr = None, plot_f = N
             from that stored in the `pot.cfg` file.
         plot_f (bool, optional): True if the system is going to be plotted.
         outfile (str, optional): The path to the desired output file.
+        fmt (str, optional): The output format, see :mod:`basis.output`.
+        cache (SolutionCache, optional): The on-disk cache of solutions.
+        converge (float, optional): When specified, the basis is doubled,
+            starting from `n_basis`, until the lowest `n_solutions`
+            eigenvalues change by no more than this.
+        max_basis (int, optional): The largest basis to try when converging.
+        assembly (str, optional): How the hamiltonian matrix is built, see
+            :class:`basis.hamiltonian.Hamiltonian`.
 
     Returns:
        Output is saved to a csv file `1D_potential_sol.csv". If plot_f = 
            True a plot window is returned.
     """
 
-    ham = Hamiltonian(potcfg, n_basis, xl, xr)
-    eigen_vals = ham.eigenvals[:n_solutions]
-    eigen_vecs = np.transpose(ham.eigenvecs[:n_solutions])
-
-    with open(outfile,"w+") as outf:
-        outf.write("Eigenval      Eigenvec\n")
+    # The plots need more of the spectrum than is written to file.
+    n_states = n_solutions
+    if plot_f == "en": # pragma: no cover
+        n_states = max(n_states, 35)
+    elif plot_f == "waves": # pragma: no cover
+        n_states = max(n_states, 10)
 
-        for i in range(n_solutions):
-            temp = [str(eigen_vals[i])+"      "]
-            for j in range(len(eigen_vecs)):
-                temp.append(str(eigen_vecs[i][j]))
+    ham = Hamiltonian(potcfg, n_basis, xl, xr, n_solutions=n_states,
+                      cache=cache, assembly=assembly)
+    if converge is not None:
+        if ham.converge(converge, n_solutions, max_basis=max_basis):
+            msg.okay("Converged with {} basis functions.".format(ham.n_basis))
+        else:
+            wmsg = "The eigenvalues did not converge with {} basis functions."
+            msg.warn(wmsg.format(ham.n_basis))
+    ham.eigenvals
+    with timing.phase("write"):
+        write_solution(ham, n_solutions, outfile, fmt)
+    eigen_vals = ham.eigenvals
 
-            outf.write(" ".join(temp)+"\n")
+    if plot_f is None:
+        return
 
-    L = abs(ham.domain[1] - ham.domain[0])
+    # matplotlib is slow to import, so it is only loaded for plotting.
+    import matplotlib.pyplot as plt # pragma: no cover
+    L = abs(ham.domain[1] - ham.domain[0]) # pragma: no cover
     if plot_f == "pot": # pragma: no cover
         xs = np.arange(ham.domain[0],ham.domain[1],0.01)
-        Vs = list(map(ham.pot,xs))
+        Vs = ham.pot(xs)
         plt.plot(xs,Vs)
         plt.savefig('pot.pdf')
 
     elif plot_f == "waves": # pragma: no cover
-        for i in [0,9]:
-            wave = eigen_vecs[i]
-            xs = np.arange(ham.domain[0],ham.domain[1],0.01)
-            psi_x = []
-            env = []
-            for x in xs:
-                sin_x = 0
-                for n in range(len(wave)):
-                    sin_x += wave[n]*np.sqrt(2./L)*np.sin((n+1)*np.pi*x/L)
-                env.append(np.sin(x*np.pi*(i+1)/L))
-                psi_x.append(sin_x)
-            plt.plot(xs,psi_x)
-            plt.plot(xs,env)
-            
+        xs = np.arange(ham.domain[0],ham.domain[1],0.01)
+        psi_x = psi(ham, xs, [0,9])
+        for col, i in enumerate([0,9]):
+            plt.plot(xs,psi_x[:,col])
+            plt.plot(xs,np.sin(xs*np.pi*(i+1)/L))
+
         plt.savefig('waves.pdf')
 
     elif plot_f =="en": # pragma: no cover
@@ -88,7 +182,11 @@ def examples():
     contents = [(("Solve the potential in `kp.cfg` using 200 basis functions."), 
                  "solve.py 200 -potential kp.cfg",
                  "This saves the solution to the default 'output.dat'."
-                 "file in the current directory.")]
+                 "file in the current directory."),
+                (("Solve the potential in `paper.cfg` for 1 to 10 barriers."),
+                 "solve.py 100 -potential paper.cfg -sweep n=1:10",
+                 "This saves the solutions to 'output_1.dat' through "
+                 "'output_10.dat'.")]
     required = ("REQUIRED: potential config file `pot.cfg`.")
     output = ("RETURNS: plot window if `-plot` is specified; solution "
               "output is written to file.")
@@ -106,7 +204,9 @@ script_options = {
               help=("Specifies the number of basis function to be used.")),
     "-plot": dict(help=("Plot the potential (pot), the wave functions (wave), "
                         "the energies (en).")),
-    "-potential": dict(help=("Path to the file that has the potential parameters.")),
+    "-potential": dict(help=("Path to the file that has the potential parameters, "
+                             "or to a table of the potential's values (.npy, "
+                             ".npz, .csv, .txt or .dat).")),
     "-outfile": dict(default="output.dat",
                      help="Override the default output file nome."),
     "-solutions": dict(default = 10, type=int,
@@ -116,7 +216,45 @@ script_options = {
                        "that has diffined in potential file."),
     "-right_edge": dict(default = None, type=float,
                        help="Override the right most edge of the potential "
-                       "that has diffined in potential file.")    
+                       "that has diffined in potential file."),
+    "-sweep": dict(default = None, nargs="+",
+                   help="Solve over a grid of potential parameters, e.g. "
+                   "'n=1:10' or 'v0=0:100:20 n=1,2,4'; ranges include the "
+                   "stop value. The index of each point is appended to the "
+                   "output file name."),
+    "-format": dict(default="text", choices=formats,
+                    help="The output file format: plain text (the default) "
+                    "or a binary numpy archive."),
+    "-cache": dict(default=None,
+                   help="Directory of an on-disk cache of solutions; "
+                   "identical systems are then only solved once. Defaults to "
+                   "the BASIS_CACHE environment variable, if it is set."),
+    "-no-cache": dict(action="store_true",
+                      help="Don't use the on-disk cache of solutions."),
+    "-converge": dict(default=None, type=float,
+                      help="Double the number of basis functions, starting "
+                      "from N, until the eigenvalues that are written change "
+                      "by no more than this."),
+    "-max_basis": dict(default=None, type=int,
+                       help="The largest number of basis functions to try "
+                       "with -converge; defaults to 16*N."),
+    "-timing": dict(default=None,
+                    help="Write the time spent in each phase of the solve, and "
+                    "the number of evaluations of the potential, to this JSON "
+                    "file."),
+    "-profile": dict(default=None,
+                     help="Run the solve under cProfile and dump the "
+                     "statistics to this file."),
+    "-assembly": dict(default=None, choices=assembly_methods,
+                      help="How the hamiltonian matrix is built; defaults to "
+                      "'dst' for tables of the potential's values and "
+                      "'vectorized' otherwise."),
+    "-workers": dict(default = None, type=int,
+                     help="Solve the points of a sweep in parallel on this "
+                     "many worker processes."),
+    "-resume": dict(action="store_true",
+                    help="Skip the points of a sweep whose output file "
+                    "already exists.")
     }
 """dict: default command-line arguments and their
     :meth:`argparse.ArgumentParser.add_argument` keyword arguments.
@@ -142,16 +280,49 @@ def _parser_options():
     return args
 
 def run(args):
+    """Runs the solve described by the command-line arguments, timing its
+    phases; see :mod:`basis.timing`.
+    """
 
     if not args["potential"]:
         raise KeyError("A potential file must be provided using the -potential flag.")
 
+    timing.reset()
+    counting = timing.counting
+    timing.counting = bool(args["timing"] or args["verbose"] or
+                           args["debug"])
+    try:
+        with timing.profile(args["profile"]):
+            _run(args)
+    finally:
+        timing.counting = counting
+
+    if args["verbose"] or args["debug"]:
+        timing.summary(1)
+    if args["timing"]:
+        timing.write_report(args["timing"])
+
+def _run(args):
+    """Dispatches the command-line arguments to a sweep or a single solve.
+    """
+
+    if args["sweep"]:
+        _sweep_system(args["potential"], args["N"], args["solutions"],
+                      args["sweep"], xl=args["left_edge"], xr=args["right_edge"],
+                      outfile = args["outfile"], workers = args["workers"],
+                      resume = args["resume"], fmt = args["format"],
+                      cache = _get_cache(args), assembly = args["assembly"])
     elif args["plot"]: # pragma: no cover
         _solve_system(args["potential"], args["N"], args["solutions"], xl=args["left_edge"]
-                      ,xr=args["right_edge"], outfile = args["outfile"], plot_f = args["plot"])
+                      ,xr=args["right_edge"], outfile = args["outfile"], plot_f = args["plot"],
+                      fmt = args["format"], cache = _get_cache(args),
+                      converge = args["converge"], max_basis = args["max_basis"],
+                      assembly = args["assembly"])
     else:
         _solve_system(args["potential"], args["N"], args["solutions"], xl=args["left_edge"]
-                      ,xr=args["right_edge"], outfile = args["outfile"])
+                      ,xr=args["right_edge"], outfile = args["outfile"], fmt = args["format"],
+                      cache = _get_cache(args), converge = args["converge"],
+                      max_basis = args["max_basis"], assembly = args["assembly"])
 
 if __name__ == '__main__': # pragma: no cover
     run(_parser_options())
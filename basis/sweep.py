@@ -0,0 +1,109 @@
+"""Methods for solving a 1D quantum potential over a grid of its
+parameters, reusing as much of the solution as possible between points.
+"""
+
+from itertools import product
+from basis.hamiltonian import Hamiltonian
+
+def parse_sweep(specs):
+    """Parses the parameter ranges of a sweep.
+
+    Args:
+        specs (list of str): each entry has the form `name=start:stop`,
+          `name=start:stop:step` (`stop` is included; the step defaults
+          to 1) or `name=v1,v2,...`.
+
+    Returns:
+        list of tuple: (name, values) pairs in the order they were specified.
+
+    Raises:
+        ValueError: if any of the specs is not in one of the above forms.
+
+    Examples:
+        >>> parse_sweep(["n=1:3", "v0=10,20"])
+        [('n', [1, 2, 3]), ('v0', [10, 20])]
+    """
+
+    ranges = []
+    for spec in specs:
+        if spec.count("=") != 1:
+            emsg = "'{}' is not a valid sweep; use name=start:stop[:step]."
+            raise ValueError(emsg.format(spec))
+        name, svals = spec.split("=")
+
+        try:
+            if ":" in svals:
+                limits = [_number(v) for v in svals.split(":")]
+                if len(limits) not in [2, 3]:
+                    raise ValueError
+                start, stop = limits[:2]
+                step = limits[2] if len(limits) == 3 else 1
+                values = _span(start, stop, step)
+            else:
+                values = [_number(v) for v in svals.split(",")]
+        except ValueError:
+            emsg = "'{}' is not a valid sweep; use name=start:stop[:step]."
+            raise ValueError(emsg.format(spec))
+
+        ranges.append((name.strip().lower(), values))
+
+    return ranges
+
+def _number(sval):
+    """Converts the string to an `int` if possible, otherwise a `float`.
+    """
+    try:
+        return int(sval)
+    except ValueError:
+        return float(sval)
+
+def _span(start, stop, step):
+    """Returns the values from `start` to `stop` (inclusive) in steps of
+    `step`.
+    """
+    if step == 0 or (stop - start)*step < 0:
+        raise ValueError("The step has to move from start towards stop.")
+
+    n_steps = int(round((stop - start)/float(step)))
+    return [start + i*step for i in range(n_steps + 1)]
+
+def sweep_grid(ranges):
+    """Expands the parameter ranges into the points of the sweep.
+
+    Args:
+        ranges (list of tuple): (name, values) pairs, see :func:`parse_sweep`.
+
+    Returns:
+        list of dict: the parameter values at each point; the last parameter
+          varies fastest.
+    """
+
+    names = [name for name, values in ranges]
+    return [dict(zip(names, point))
+            for point in product(*[values for name, values in ranges])]
+
+def sweep(potcfg, n_basis, grid, xi=None, xf=None, **kwargs):
+    """Solves the system at each point of a parameter sweep. A single
+    :class:`Hamiltonian` is adjusted from point to point so that the kinetic
+    energy and anything else that doesn't depend on the swept parameters is
+    only computed once.
+
+    Args:
+        potcfg (str): path to the potential configuration file.
+        n_basis (int): The number of basis functions to use in the solution.
+        grid (list of dict): the parameter values at each point of the sweep,
+          see :func:`sweep_grid`.
+        xi (float, optional): The left most edge of the potential.
+        xf (float, optional): The right most edge of the potential.
+        kwargs (dict): additional keyword arguments for :class:`Hamiltonian`.
+
+    Returns:
+        generator: yields a (params, ham) tuple for each point of the sweep;
+          `ham` is the same :class:`Hamiltonian` object at every point, so
+          copy anything that has to outlive the next iteration.
+    """
+
+    ham = Hamiltonian(potcfg, n_basis, xi, xf, **kwargs)
+    for params in grid:
+        ham.adjust_potential(**params)
+        yield params, ham
@@ -0,0 +1,114 @@
+"""Records where the time of a solve goes. The phases of a solve (parsing
+the potential, finding the barriers, assembling and diagonalizing the
+hamiltonian, writing the output, ...) are timed with the :func:`phase`
+context manager and cheap events, such as evaluations of the potential, are
+tallied with :func:`count` while :data:`counting` is on. The totals are kept
+for the whole process until :func:`reset` is called.
+
+Examples:
+    >>> from basis import timing
+    >>> with timing.phase("assemble"):
+    ...     h.ham
+    >>> timing.write_report("timing.json")
+"""
+
+from contextlib import contextmanager
+import time
+from basis import msg
+
+phases = {}
+"""dict: keys are phase names; values are dicts with the total `time` in
+seconds and the number of `calls`.
+"""
+counters = {}
+"""dict: keys are counter names; values are their totals.
+"""
+counting = False
+"""bool: whether the events in hot paths, such as the evaluations of the
+potential, are counted; they are checked before calling :func:`count`, so
+that they cost nothing when it is off.
+"""
+_order = []
+
+def reset():
+    """Discards all the recorded timings and counts.
+    """
+    phases.clear()
+    counters.clear()
+    del _order[:]
+
+@contextmanager
+def phase(name):
+    """Times the code in the `with` block as (another call of) the named
+    phase. Phases may be nested; each one includes the time of the phases
+    inside it.
+
+    Args:
+        name (str): the name of the phase.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if name not in phases:
+            phases[name] = {"time": 0., "calls": 0}
+            _order.append(name)
+        phases[name]["time"] += elapsed
+        phases[name]["calls"] += 1
+        msg.info("{} took {:.4f}s.".format(name, elapsed), 3)
+
+def count(name, n=1):
+    """Adds `n` to the named counter.
+    """
+    counters[name] = counters.get(name, 0) + n
+
+def report():
+    """Returns the recorded timings and counts.
+
+    Returns:
+        dict: with keys `phases`, a list of dicts with the `name`, total
+          `time` and `calls` of each phase in the order they were first
+          entered, and `counters`, a dict of the counter totals.
+    """
+    return {"phases": [dict(name=name, **phases[name]) for name in _order],
+            "counters": dict(counters)}
+
+def write_report(filepath):
+    """Writes the :func:`report` to a JSON file.
+    """
+    import json
+    with open(filepath, "w") as f:
+        json.dump(report(), f, indent=1, sort_keys=True)
+
+def summary(level=2):
+    """Prints the time spent in each phase and the counter totals.
+
+    Args:
+        level (int, optional): the verbosity level of the messages.
+    """
+    for name in _order:
+        msg.info("{:<12} {:>10.4f}s in {} call(s)".format(
+            name, phases[name]["time"], phases[name]["calls"]), level)
+    for name in sorted(counters):
+        msg.info("{:<12} {:>10}".format(name, counters[name]), level)
+
+@contextmanager
+def profile(filepath=None):
+    """Runs the code in the `with` block under `cProfile` and dumps the
+    statistics to `filepath`, e.g. for `python -m pstats`. Nothing is
+    profiled when `filepath` is None.
+    """
+    if filepath is None:
+        yield
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filepath)
+        msg.info("Wrote the profile to {}.".format(filepath), 2)
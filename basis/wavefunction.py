@@ -0,0 +1,111 @@
+"""Methods for evaluating the eigenstates of a solved system in real space.
+
+The eigenstates are expansions in the basis sqrt(2/L) sin(n pi x/L), so a
+block of them is evaluated on a grid as a single matrix product between the
+sampled basis functions and the eigenvector block. On uniform grids the sums
+are the discrete sine and cosine transforms of the eigenvectors, which
+:func:`psi_grid` uses when `scipy` is installed.
+"""
+
+import numpy as np
+
+def sine_basis(x, n_basis, L):
+    """Samples the basis functions on a grid.
+
+    Args:
+        x (np.ndarray): The points to sample.
+        n_basis (int): The number of basis functions.
+        L (float): The width of the domain.
+
+    Returns:
+        np.ndarray: A (len(x), n_basis) array whose columns are the basis
+          functions.
+    """
+
+    ks = np.arange(1, n_basis + 1)*np.pi/L
+    return np.sqrt(2./L)*np.sin(np.outer(x, ks))
+
+def _select(ham, states):
+    """Returns the eigenvector block of the selected states.
+
+    Args:
+        ham (Hamiltonian): The solved system.
+        states (int, list, slice or None): The indices of the eigenstates;
+          None selects every eigenstate that was found.
+    """
+
+    if states is None:
+        states = slice(None)
+    elif isinstance(states, (int, np.integer)):
+        states = [states]
+    return ham.eigenvecs[:,states]
+
+def psi(ham, x, states=None):
+    """Evaluates eigenstates of the system.
+
+    Args:
+        ham (Hamiltonian): The solved system.
+        x (float or np.ndarray): The points to evaluate the eigenstates at.
+        states (int, list, slice, optional): The indices of the eigenstates
+          to evaluate; defaults to every eigenstate that was found.
+
+    Returns:
+        np.ndarray: A (len(x), n_states) array with the value of each state
+          in a column.
+
+    Examples:
+        >>> from basis.hamiltonian import Hamiltonian
+        >>> from basis.wavefunction import psi
+        >>> h = Hamiltonian("kp.cfg", 200, n_solutions=10)
+        >>> xs = np.linspace(0, 20, 2000)
+        >>> density = abs(psi(h, xs))**2
+    """
+
+    x = np.atleast_1d(np.asarray(x, dtype=float))
+    L = abs(ham.domain[1] - ham.domain[0])
+    vecs = _select(ham, states)
+    return np.dot(sine_basis(x, len(vecs), L), vecs)
+
+def psi_grid(ham, n_points, states=None):
+    """Evaluates eigenstates of the system on `n_points` evenly spaced
+    points strictly inside the domain.
+
+    Args:
+        ham (Hamiltonian): The solved system.
+        n_points (int): The number of grid points.
+        states (int, list, slice, optional): The indices of the eigenstates
+          to evaluate; defaults to every eigenstate that was found.
+
+    Returns:
+        tuple: (x, psi) where `psi` is a (n_points, n_states) array with the
+          value of each state in a column.
+    """
+
+    xi, xf = ham.domain
+    L = abs(xf - xi)
+    x = xi + L*np.arange(1, n_points + 1)/(n_points + 1.)
+    vecs = _select(ham, states)
+    n_basis = len(vecs)
+
+    try:
+        from scipy.fft import dct, dst
+    except ImportError: # pragma: no cover
+        return x, np.dot(sine_basis(x, n_basis, L), vecs)
+
+    if n_points < n_basis:
+        return x, np.dot(sine_basis(x, n_basis, L), vecs)
+
+    # The basis is defined on absolute positions, so for a domain that
+    # doesn't start at zero each term splits into
+    # sin(n pi xi/L) cos(n pi j/(M+1)) + cos(n pi xi/L) sin(n pi j/(M+1)),
+    # the type I cosine and sine transforms of the weighted coefficients.
+    phase = np.arange(1, n_basis + 1)*np.pi*xi/L
+    sin_coefs = np.zeros((n_points, vecs.shape[1]))
+    sin_coefs[:n_basis] = np.cos(phase)[:,None]*vecs
+    values = dst(sin_coefs, type=1, axis=0)/2.
+    if xi != 0:
+        cos_coefs = np.zeros((n_points + 2, vecs.shape[1]))
+        cos_coefs[1:n_basis + 1] = np.sin(phase)[:,None]*vecs
+        values += dct(cos_coefs, type=1, axis=0)[1:-1]/2.
+
+    return x, np.sqrt(2./L)*values
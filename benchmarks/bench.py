@@ -0,0 +1,247 @@
+#!/usr/bin/python
+"""Times the phases of a solve (evaluating the potential, finding the
+barriers, assembling the hamiltonian, diagonalizing it and writing the
+solution) for each potential in `potentials/` over a range of basis sizes,
+and records the peak memory of each phase.
+
+Results can be saved to a baselines file, keyed by the commit they were
+measured at, and later runs compared against them:
+
+    python benchmarks/bench.py -save
+    python benchmarks/bench.py -compare
+
+Timings are the best of `-repeat` runs; the peak memory is measured in a
+separate run with `tracemalloc`, which slows the code it traces down.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from glob import glob
+from os import path
+
+root = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import numpy as np
+from basis.hamiltonian import Hamiltonian
+from basis.output import write_solution
+
+default_sizes = [100, 500, 1000, 2000]
+"""list: the numbers of basis functions benchmarked by default.
+"""
+default_baselines = path.join(root, "benchmarks", "baselines.json")
+"""str: the default file that baselines are saved to and compared against.
+"""
+phases = ["potential", "find_xrs", "construct", "eigh", "write_text",
+          "write_npz"]
+"""list: the phases of a solve that are benchmarked.
+"""
+
+def _phase_functions(potcfg, n_basis, workdir):
+    """Returns a setup and a run function for each phase of a solve. The
+    setup isn't timed; it returns the argument for the run function.
+
+    Raises:
+        ValueError: if the potential can't be parsed.
+    """
+
+    ham = Hamiltonian(potcfg, n_basis)
+    L = abs(ham.domain[1] - ham.domain[0])
+    xs = ham.domain[0] + L*np.arange(100*n_basis)/(100.*n_basis)
+    ham._steps = ham._find_xrs()
+    ham.ham
+    ham.eigenvals
+    text = path.join(workdir, "bench.dat")
+    binary = path.join(workdir, "bench.npz")
+
+    def reset_ham():
+        ham._heights = {}
+        ham._sines = {}
+        return ham
+
+    return {
+        "potential": (lambda: xs, lambda x: ham.pot(x)),
+        "find_xrs": (lambda: ham, lambda h: h._find_xrs()),
+        "construct": (reset_ham, lambda h: h._construct_ham(n_basis)),
+        "eigh": (lambda: ham.ham, lambda m: np.linalg.eigh(m, UPLO="U")),
+        "write_text": (lambda: ham, lambda h: write_solution(h, 10, text)),
+        "write_npz": (lambda: ham,
+                      lambda h: write_solution(h, n_basis, binary, "npz")),
+        }
+
+def _measure(setup, run, repeat):
+    """Returns the best time of `repeat` runs and the peak memory in bytes
+    of one traced run.
+    """
+
+    times = []
+    for i in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - start)
+
+    arg = setup()
+    tracemalloc.start()
+    run(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"time": min(times), "peak": peak}
+
+def benchmark(potcfgs, sizes, repeat=3):
+    """Benchmarks every phase for each potential and basis size.
+
+    Args:
+        potcfgs (list of str): paths to the potential configuration files.
+        sizes (list of int): the numbers of basis functions.
+        repeat (int, optional): the number of timed runs of each phase.
+
+    Returns:
+        dict: results[potential][size][phase] is a dict with the best `time`
+          in seconds and the `peak` memory in bytes.
+    """
+
+    results = {}
+    workdir = tempfile.mkdtemp()
+    for potcfg in potcfgs:
+        name = path.splitext(path.basename(potcfg))[0]
+        results[name] = {}
+        for n_basis in sizes:
+            try:
+                functions = _phase_functions(potcfg, n_basis, workdir)
+            except ValueError as error:
+                # Some of the example files are deliberately invalid.
+                print("{:>10} skipped: {}".format(name, error))
+                del results[name]
+                break
+            entries = dict((phase, _measure(functions[phase][0],
+                                            functions[phase][1], repeat))
+                           for phase in phases)
+            results[name][str(n_basis)] = entries
+            print("{:>10} N={:<5} ".format(name, n_basis) +
+                  " ".join("{}={:.4f}s".format(phase, entries[phase]["time"])
+                           for phase in phases))
+
+    for filename in os.listdir(workdir):
+        os.remove(path.join(workdir, filename))
+    os.rmdir(workdir)
+    return results
+
+def _commit():
+    """Returns the hash of the checked out commit, or 'unknown'.
+    """
+    try:
+        out = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                      cwd=root, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return out.decode().strip()
+
+def _load_baselines(filepath):
+    if not path.isfile(filepath):
+        return {}
+    with open(filepath) as f:
+        return json.load(f)
+
+def save(results, filepath):
+    """Adds the results to the baselines file under the current commit.
+    """
+
+    baselines = _load_baselines(filepath)
+    baselines[_commit()] = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                            "python": sys.version.split()[0],
+                            "numpy": np.__version__,
+                            "results": results}
+    with open(filepath, "w") as f:
+        json.dump(baselines, f, indent=1, sort_keys=True)
+
+def compare(results, filepath, commit=None, threshold=0.2):
+    """Compares the results with a saved baseline and reports the phases
+    that got slower or used more memory.
+
+    Args:
+        results (dict): the results of :func:`benchmark`.
+        filepath (str): the baselines file.
+        commit (str, optional): the commit of the baseline; defaults to the
+          most recently saved one.
+        threshold (float, optional): the relative increase that counts as a
+          regression.
+
+    Returns:
+        list of str: a description of each regression.
+    """
+
+    baselines = _load_baselines(filepath)
+    if len(baselines) == 0:
+        print("No baselines in {}.".format(filepath))
+        return []
+    if commit is None:
+        commit = max(baselines, key=lambda key: baselines[key]["date"])
+    base = baselines[commit]["results"]
+
+    regressions = []
+    for name, sizes in results.items():
+        for n_basis, entries in sizes.items():
+            for phase, entry in entries.items():
+                try:
+                    old = base[name][n_basis][phase]
+                except KeyError:
+                    continue
+                for quantity in ["time", "peak"]:
+                    if entry[quantity] > (1 + threshold)*old[quantity] > 0:
+                        regressions.append(
+                            "{} N={} {}: {} went from {:.4g} to {:.4g}".format(
+                                name, n_basis, phase, quantity, old[quantity],
+                                entry[quantity]))
+
+    print("Compared with {}: {} regression(s).".format(commit,
+                                                       len(regressions)))
+    for regression in regressions:
+        print("  " + regression)
+    return regressions
+
+def _parser_options():
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmarks the phases of "
+                                     "the basis expansion solver.")
+    parser.add_argument("-potentials", nargs="+",
+                        default=sorted(glob(path.join(root, "potentials",
+                                                      "*.cfg"))),
+                        help="The potential files to benchmark; defaults to "
+                        "all of those in potentials/.")
+    parser.add_argument("-sizes", nargs="+", type=int, default=default_sizes,
+                        help="The numbers of basis functions to benchmark.")
+    parser.add_argument("-repeat", type=int, default=3,
+                        help="The number of timed runs of each phase.")
+    parser.add_argument("-baselines", default=default_baselines,
+                        help="The file that baselines are kept in.")
+    parser.add_argument("-save", action="store_true",
+                        help="Save the results as the baseline for the "
+                        "current commit.")
+    parser.add_argument("-compare", nargs="?", const="latest", default=None,
+                        help="Compare the results with the baseline of the "
+                        "given commit; defaults to the latest baseline.")
+    parser.add_argument("-threshold", type=float, default=0.2,
+                        help="The relative increase reported as a regression.")
+    parser.add_argument("-output", default=None,
+                        help="Also write the results to this JSON file.")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = _parser_options()
+    results = benchmark(args.potentials, args.sizes, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        commit = None if args.compare == "latest" else args.compare
+        regressions = compare(results, args.baselines, commit, args.threshold)
+    if args.save:
+        save(results, args.baselines)
+    if args.compare and regressions:
+        sys.exit(1)
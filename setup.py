@@ -18,7 +18,7 @@ except ImportError:
 
 from os import path
 setup(name='basis',
-      version='0.0.7',
+      version='0.0.8',
       description='Basis expansion for 1D quantum potentials',
       long_description= "" if not path.isfile("README.md") else read_md('README.md'),
       author='Wiley S Morgan',
@@ -31,8 +31,10 @@ setup(name='basis',
           "argparse",
           "termcolor",
           "numpy",
+          "scipy",
           "matplotlib",
       ],
+      python_requires='>=3.7',
       packages=['basis'],
       scripts=['basis/solve.py'],
       package_data={'basis': []},
@@ -43,9 +45,11 @@ setup(name='basis',
           'Natural Language :: English',
           'Operating System :: MacOS',
           'Programming Language :: Python',
-          'Programming Language :: Python :: 2',
-          'Programming Language :: Python :: 2.7',
           'Programming Language :: Python :: 3',
-          'Programming Language :: Python :: 3.5',
+          'Programming Language :: Python :: 3.7',
+          'Programming Language :: Python :: 3.8',
+          'Programming Language :: Python :: 3.9',
+          'Programming Language :: Python :: 3.10',
+          'Programming Language :: Python :: 3.11',
       ],
      )
@@ -0,0 +1,76 @@
+"""Tests the parallel batch runner for independent solves."""
+
+import pytest
+from basis.batch import spec_grid, run_batch, solve_spec
+from basis.hamiltonian import Hamiltonian
+import numpy as np
+
+def test_spec_grid():
+    """Tests the expansion of the batch ranges into specs.
+    """
+
+    specs = spec_grid({"potcfg": "potentials/kp.cfg", "outfile": "kp_{n_basis}_{v0}.dat"},
+                      n_basis=[10, 20], params=[{"v0": 1.}, {"v0": 2.}])
+    assert len(specs) == 4
+    assert specs[1]["n_basis"] == 10
+    assert specs[1]["params"] == {"v0": 2.}
+    assert specs[1]["outfile"] == "kp_10_2.0.dat"
+    assert specs[-1]["outfile"] == "kp_20_2.0.dat"
+
+def test_solve_spec(tmpdir):
+    """Tests that a single spec matches a direct solve.
+    """
+
+    outfile = str(tmpdir.join("kp.dat"))
+    spec = {"potcfg": "potentials/kp.cfg", "n_basis": 20, "n_solutions": 3,
+            "params": {"v0": 30.}, "outfile": outfile}
+    vals = solve_spec(spec)
+
+    ham = Hamiltonian("potentials/kp.cfg", 20)
+    ham.adjust_potential(v0=30.)
+    assert np.allclose(vals, ham.eigenvals[:3])
+    assert len(open(outfile).readlines()) == 4
+    assert not tmpdir.join("kp.dat.part").check()
+
+def test_run_batch(tmpdir):
+    """Tests that the batch results come back in order and that existing
+    outputs are skipped.
+    """
+
+    specs = spec_grid({"potcfg": "potentials/kp.cfg", "n_solutions": 2,
+                       "outfile": str(tmpdir.join("kp_{n_basis}.dat"))},
+                      n_basis=[8, 12, 16])
+    tmpdir.join("kp_12.dat").write("done")
+
+    results = run_batch(specs, max_workers=2)
+    assert [r["outfile"] for r in results] == [s["outfile"] for s in specs]
+    assert [r["skipped"] for r in results] == [False, True, False]
+    assert results[1]["eigenvals"] is None
+    assert tmpdir.join("kp_12.dat").read() == "done"
+    for r, n_basis in zip(results[::2], [8, 16]):
+        ham = Hamiltonian("potentials/kp.cfg", n_basis)
+        assert np.allclose(r["eigenvals"], ham.eigenvals[:2])
+
+    results = run_batch(specs, max_workers=2)
+    assert all(r["skipped"] for r in results)
+
+def test_limit_threads(monkeypatch):
+    """Tests that spawned workers see the BLAS thread limits and that the
+    environment is restored afterwards.
+    """
+
+    import os
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from basis.batch import _limit_threads
+    monkeypatch.setenv("OMP_NUM_THREADS", "7")
+    monkeypatch.delenv("MKL_NUM_THREADS", raising=False)
+
+    context = multiprocessing.get_context("spawn")
+    with _limit_threads(1):
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            limits = [pool.submit(os.getenv, var).result()
+                      for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS"]]
+    assert limits == ["1", "1"]
+    assert os.environ["OMP_NUM_THREADS"] == "7"
+    assert "MKL_NUM_THREADS" not in os.environ
@@ -0,0 +1,97 @@
+"""Tests the on-disk cache of hamiltonians and eigenstates."""
+
+import pytest
+import os
+from basis.cache import SolutionCache
+from basis.hamiltonian import Hamiltonian
+import numpy as np
+
+def test_cache(tmpdir):
+    """Tests that a cached hamiltonian is read back instead of rebuilt.
+    """
+
+    cache = SolutionCache(str(tmpdir.join("cache")))
+    ham = Hamiltonian("potentials/kp.cfg", 10, cache=cache)
+    matrix = ham.ham
+    assert len(os.listdir(cache.directory)) == 1
+    vals = ham.eigenvals
+    assert len(os.listdir(cache.directory)) == 2
+
+    again = Hamiltonian("potentials/kp.cfg", 10, cache=cache)
+    again._construct_ham = None
+    assert np.array_equal(again.eigenvals, vals)
+    assert again._ham is None
+    assert np.array_equal(again.ham, matrix)
+
+    # A different solver setting reuses the matrix but not the eigenstates.
+    lowest = Hamiltonian("potentials/kp.cfg", 10, n_solutions=3, cache=cache)
+    lowest._construct_ham = None
+    assert np.allclose(lowest.eigenvals, vals[:3])
+    assert len(os.listdir(cache.directory)) == 3
+
+    changed = Hamiltonian("potentials/kp.cfg", 10, cache=cache)
+    changed.adjust_potential(v0=30.)
+    assert cache.matrix_key(changed) != cache.matrix_key(ham)
+    assert not np.allclose(changed.eigenvals, vals)
+
+    cache.clear()
+    assert os.listdir(cache.directory) == []
+
+def test_evict(tmpdir):
+    """Tests that the least recently used entries are removed first.
+    """
+
+    cache = SolutionCache(str(tmpdir), max_size=2000)
+    first = Hamiltonian("potentials/kp.cfg", 10, cache=cache)
+    first.ham
+    path = os.path.join(cache.directory, cache.matrix_key(first) + ".npy")
+    os.utime(path, (0, 0))
+    assert os.path.isfile(path)
+
+    second = Hamiltonian("potentials/bump.cfg", 10, cache=cache)
+    second.ham
+    assert len(os.listdir(cache.directory)) == 2
+    third = Hamiltonian("potentials/sho.cfg", 10, cache=cache)
+    third.ham
+    assert not os.path.isfile(path)
+    assert len(os.listdir(cache.directory)) == 2
+
+def test_concurrent_evict(tmpdir, monkeypatch):
+    """Tests that entries removed by another process during an eviction are
+    skipped.
+    """
+
+    cache = SolutionCache(str(tmpdir), max_size=0)
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir",
+                        lambda path: listdir(path) + ["gone.npy"])
+    ham = Hamiltonian("potentials/kp.cfg", 10, cache=cache)
+    ham.ham
+    assert listdir(cache.directory) == []
+
+    remove = os.remove
+    def removed_elsewhere(path):
+        remove(path)
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, "remove", removed_elsewhere)
+    ham.eigenvals
+    assert listdir(cache.directory) == []
+
+def test_fingerprint(tmpdir):
+    """Tests that every parameter, including lists and arrays, is part of
+    the cache key.
+    """
+
+    from basis.potential import Potential
+    potcfg = tmpdir.join("list.cfg")
+    potcfg.write("[parameters]\nv = [1., 2.]\n[regions]\n1=0, 1 | v[0]")
+    pot = Potential(str(potcfg))
+    other = Potential(str(potcfg))
+    assert pot.fingerprint() == other.fingerprint()
+    other.adjust_potential(v=[3., 2.])
+    assert pot.fingerprint() != other.fingerprint()
+
+    pot.params["v"] = np.zeros(5000)
+    other.params["v"] = np.zeros(5000)
+    other.params["v"][2500] = 1.
+    assert pot.fingerprint() != other.fingerprint()
@@ -1,8 +1,448 @@
 """Tests the evaluation of the eigenvalues and eigenvectors of 1D-quantum potentials."""
 
 import pytest
-from basis.hamiltonian import Hamiltonian
+from basis.hamiltonian import Hamiltonian, pack_upper, unpack_upper
 import numpy as np
 import sys
 
+def test_vectorized_assembly():
+    """Tests that the vectorized assembly matches the element by element
+    reference assembly.
+    """
 
+    for potcfg in ["potentials/bump.cfg", "potentials/kp.cfg",
+                   "potentials/paper.cfg"]:
+        ham = Hamiltonian(potcfg, 20)
+        ref = Hamiltonian(potcfg, 20, assembly="reference")
+        assert np.array_equal(ham.ham, ref.ham)
+
+def test_assembly_method():
+    """Tests that an unknown assembly method raises an error.
+    """
+
+    with pytest.raises(ValueError):
+        Hamiltonian("potentials/bump.cfg", 2, assembly="dummy")
+
+def test_storage():
+    """Tests that the upper and packed storage modes hold the same matrix
+    and give the same spectrum as the full storage.
+    """
+
+    full = Hamiltonian("potentials/kp.cfg", 15)
+    upper = Hamiltonian("potentials/kp.cfg", 15, storage="upper")
+    packed = Hamiltonian("potentials/kp.cfg", 15, storage="packed")
+
+    assert np.array_equal(upper.ham, np.triu(full.ham))
+    assert np.array_equal(packed.ham, pack_upper(full.ham))
+    assert np.array_equal(unpack_upper(packed.ham), full.ham)
+    assert np.allclose(upper.eigenvals, full.eigenvals)
+    assert np.allclose(packed.eigenvals, full.eigenvals)
+
+    ref = Hamiltonian("potentials/kp.cfg", 15, assembly="reference",
+                      storage="packed")
+    assert np.array_equal(ref.ham, packed.ham)
+
+    # The triangle is assembled in blocks of rows; this size needs several.
+    full = Hamiltonian("potentials/kp.cfg", 600)
+    ref = Hamiltonian("potentials/kp.cfg", 600, assembly="dst")
+    for storage in ["upper", "packed"]:
+        ham = Hamiltonian("potentials/kp.cfg", 600, storage=storage)
+        dst = Hamiltonian("potentials/kp.cfg", 600, storage=storage,
+                          assembly="dst")
+        for stored, dense in [(ham, full), (dst, ref)]:
+            if storage == "packed":
+                assert np.array_equal(stored.ham, pack_upper(dense.ham))
+            else:
+                assert np.array_equal(stored.ham, np.triu(dense.ham))
+
+    with pytest.raises(ValueError):
+        Hamiltonian("potentials/kp.cfg", 2, storage="dummy")
+    with pytest.raises(ValueError):
+        unpack_upper(np.zeros(4))
+
+def test_partial_spectrum():
+    """Tests that solving for only the lowest states or an energy window
+    agrees with the full spectrum.
+    """
+
+    full = Hamiltonian("potentials/kp.cfg", 40)
+    lowest = Hamiltonian("potentials/kp.cfg", 40, n_solutions=5)
+    assert len(lowest.eigenvals) == 5
+    assert lowest.eigenvecs.shape == (40, 5)
+    assert np.allclose(lowest.eigenvals, full.eigenvals[:5])
+    assert np.allclose(abs(lowest.eigenvecs), abs(full.eigenvecs[:,:5]))
+
+    window = Hamiltonian("potentials/kp.cfg", 40, energy_window=(0, 15))
+    keep = (full.eigenvals > 0) & (full.eigenvals <= 15)
+    assert np.allclose(window.eigenvals, full.eigenvals[keep])
+
+    clamped = Hamiltonian("potentials/kp.cfg", 3, n_solutions=10)
+    assert len(clamped.eigenvals) == 3
+
+def test_lanczos():
+    """Tests the iterative solver against the full spectrum.
+    """
+
+    pytest.importorskip("scipy")
+    full = Hamiltonian("potentials/kp.cfg", 40)
+    lanczos = Hamiltonian("potentials/kp.cfg", 40, n_solutions=5,
+                          solver="lanczos")
+    assert np.allclose(lanczos.eigenvals, full.eigenvals[:5])
+    assert np.allclose(abs(lanczos.eigenvecs), abs(full.eigenvecs[:,:5]),
+                       atol=1e-6)
+    subset = Hamiltonian("potentials/kp.cfg", 200, n_solutions=5)
+    for storage in ["full", "upper", "packed"]:
+        stored = Hamiltonian("potentials/kp.cfg", 200, n_solutions=5,
+                             solver="lanczos", storage=storage)
+        assert np.allclose(stored.eigenvals, subset.eigenvals)
+        assert np.allclose(np.abs(np.sum(stored.eigenvecs*subset.eigenvecs,
+                                         axis=0)), 1.)
+
+    with pytest.raises(ValueError):
+        Hamiltonian("potentials/kp.cfg", 2, solver="lanczos")
+    with pytest.raises(ValueError):
+        Hamiltonian("potentials/kp.cfg", 2, solver="dummy")
+    with pytest.raises(ValueError):
+        Hamiltonian("potentials/kp.cfg", 10, n_solutions=0)
+
+def test_lazy():
+    """Tests that the matrix and eigenstates are only computed when they are
+    accessed and are recomputed after invalidation.
+    """
+
+    ham = Hamiltonian("potentials/kp.cfg", 10)
+    assert ham.domain == [0, 20.]
+    assert ham._ham is None
+    assert ham._eigen is None
+
+    matrix = ham.ham
+    assert ham._eigen is None
+    assert ham.ham is matrix
+
+    vals = ham.eigenvals
+    assert ham.eigenvecs.shape == (10, 10)
+    ham.invalidate(ham=False)
+    assert ham._eigen is None
+    assert ham.ham is matrix
+
+    ham.pot.adjust_potential(v0=30.)
+    ham.invalidate()
+    assert ham.ham is not matrix
+    assert not np.allclose(ham.eigenvals, vals)
+
+def test_find_xrs(tmpdir):
+    """Tests that the steps of the potential are found at the region edges
+    and at the jumps inside function regions.
+    """
+
+    ham = Hamiltonian("potentials/bump.cfg", 2)
+    xr, width_b = ham._find_xrs()
+    assert xr == [0.]
+    assert width_b == [2.]
+
+    ham = Hamiltonian("potentials/kp.cfg", 2)
+    xr, width_b = ham._find_xrs()
+    assert len(xr) == 10
+    assert np.allclose(width_b, 1.75, rtol=0, atol=ham.tol)
+    assert np.allclose(xr, 2*np.arange(10) + 0.875, rtol=0, atol=ham.tol)
+
+    coarse = Hamiltonian("potentials/kp.cfg", 2, divs=0.5, tol=1e-6)
+    xr, width_b = coarse._find_xrs()
+    assert np.allclose(width_b, 1.75, rtol=0, atol=1e-6)
+
+    ham = Hamiltonian("potentials/sho.cfg", 2)
+    xr, width_b = ham._find_xrs()
+    steps = np.array(width_b)/ham.divs
+    assert np.allclose(steps, np.round(steps))
+    assert np.isclose(sum(width_b), ham.domain[1] - ham.domain[0])
+
+    potcfg = tmpdir.join("narrow.cfg")
+    potcfg.write("[parameters]\nv0 = 15.\n\n[regions]\n"
+                 "1=0, 0.5 | 0\n2=0.5, 0.5001 | v0\n3=0.5001, 1 | 0\n"
+                 "4=1, 1.0001 | lambda x: v0\n5=1.0001, 2 | 0")
+    ham = Hamiltonian(str(potcfg), 2)
+    xr, width_b = ham._find_xrs()
+    assert np.allclose(xr, [0.50005, 1.00005])
+    assert np.allclose(width_b, [0.0001, 0.0001])
+
+def test_barrier_cache():
+    """Tests that the potential is only evaluated once per barrier while the
+    matrix is assembled, and that the cache is cleared on invalidation.
+    """
+
+    ham = Hamiltonian("potentials/kp.cfg", 8)
+    xr, width_b = ham._find_xrs()
+    pot = ham.pot
+    calls = []
+    def counted(x):
+        calls.append(x)
+        return pot(x)
+
+    ham.pot = counted
+    ham._assemble_reference(8, xr, width_b)
+    assert len(calls) == len(xr)
+    ham._assemble_vectorized(8, xr, width_b)
+    assert len(calls) == len(xr)
+    assert len(ham._sines) == 2*len(xr)
+
+    ham.invalidate()
+    assert ham._heights == {}
+
+def test_adjust_potential():
+    """Tests that adjusting the potential only rebuilds what depends on its
+    parameters.
+    """
+
+    ham = Hamiltonian("potentials/kp.cfg", 10)
+    matrix = ham.ham
+    kinetic = ham._kinetic
+    sines = dict(ham._sines)
+
+    ham.adjust_potential(v0=30.)
+    assert ham._kinetic is kinetic
+    assert not np.allclose(ham.ham, matrix)
+    assert ham._kinetic is kinetic
+    for key in sines:
+        assert ham._sines[key] is sines[key]
+    fresh = Hamiltonian("potentials/kp.cfg", 10)
+    fresh.pot.adjust_potential(v0=30.)
+    assert np.array_equal(ham.ham, fresh.ham)
+
+    ham.adjust_potential(n=5)
+    assert ham.domain == [0, 10.]
+    assert len(ham._find_xrs()[0]) == 5
+    ham.ham
+    assert ham._kinetic is not kinetic
+
+    fixed = Hamiltonian("potentials/kp.cfg", 10, xi=0., xf=20.)
+    fixed.adjust_potential(n=5)
+    assert fixed.domain == [0., 20.]
+
+def test_extend(tmpdir):
+    """Tests that growing the basis gives the same matrix as starting with
+    the larger basis, also when the matrix was read from the cache.
+    """
+
+    for storage in ["full", "upper", "packed"]:
+        ham = Hamiltonian("potentials/kp.cfg", 10, storage=storage)
+        ham.ham
+        ham.extend(7)
+        fresh = Hamiltonian("potentials/kp.cfg", 17, storage=storage)
+        assert ham.n_basis == 17
+        assert np.array_equal(ham.ham, fresh.ham)
+        assert np.allclose(ham.eigenvals, fresh.eigenvals)
+
+        ham = Hamiltonian("potentials/kp.cfg", 300, storage=storage)
+        ham.ham
+        ham.extend(300)
+        fresh = Hamiltonian("potentials/kp.cfg", 600, storage=storage)
+        assert np.array_equal(ham.ham, fresh.ham)
+
+    ref = Hamiltonian("potentials/kp.cfg", 10, assembly="reference")
+    ref.ham
+    ref.extend(2)
+    assert ref._ham is None
+    assert ref.ham.shape == (12, 12)
+
+    lazy = Hamiltonian("potentials/kp.cfg", 10)
+    lazy.extend(5)
+    assert lazy.ham.shape == (15, 15)
+
+    from basis.cache import SolutionCache
+    cache = SolutionCache(str(tmpdir))
+    Hamiltonian("potentials/kp.cfg", 10, cache=cache).ham
+    cached = Hamiltonian("potentials/kp.cfg", 10, cache=cache)
+    cached.ham
+    assert cached._steps is None
+    cached.extend(7)
+    assert np.array_equal(cached.ham,
+                          Hamiltonian("potentials/kp.cfg", 17).ham)
+
+def test_converge():
+    """Tests that the basis grows until the eigenvalues converge.
+    """
+
+    ham = Hamiltonian("potentials/sho.cfg", 10, n_solutions=3)
+    assert ham.converge(1e-2)
+    assert ham.n_basis == 80
+    previous = Hamiltonian("potentials/sho.cfg", 40, n_solutions=3)
+    assert np.allclose(ham.eigenvals, previous.eigenvals, atol=1e-2)
+
+    ham = Hamiltonian("potentials/kp.cfg", 10, n_solutions=3)
+    assert not ham.converge(1e-12, step=5, max_basis=20)
+    assert ham.n_basis == 20
+
+    ham = Hamiltonian("potentials/kp.cfg", 10, n_solutions=3)
+    assert not ham.converge(1e-12, max_basis=30)
+    assert ham.n_basis == 30
+
+    ham = Hamiltonian("potentials/sho.cfg", 10)
+    assert ham.converge(1e-2)
+    assert len(ham.eigenvals) == ham.n_basis
+
+def test_cosine_coefficients():
+    """Tests the FFT cosine coefficients against the midpoint sums they
+    replace, including domains that don't start at zero.
+    """
+
+    from basis.hamiltonian import cosine_coefficients
+    M = 64
+    for xi, L in [(0., 20.), (-3., 20.), (0.5, 4.)]:
+        xs = xi + L*(np.arange(M) + 0.5)/M
+        values = np.exp(-xs**2/7.) + xs/10.
+        C = cosine_coefficients(values, xi, L, 40)
+        expected = [np.sum(values*np.cos(k*np.pi*xs/L))/M for k in range(41)]
+        assert np.allclose(C, expected)
+
+    with pytest.raises(ValueError):
+        cosine_coefficients(values, 0., 4., M + 1)
+
+def test_dst_assembly():
+    """Tests the assembly from samples of the potential against the step
+    assembly on a smooth potential.
+    """
+
+    fine = Hamiltonian("potentials/sho.cfg", 40, divs=1e-3, n_solutions=5)
+    dst = Hamiltonian("potentials/sho.cfg", 40, assembly="dst", n_solutions=5)
+    assert np.allclose(dst.ham, dst.ham.T)
+    assert np.allclose(dst.ham, fine.ham, atol=1e-3)
+    assert np.allclose(dst.eigenvals, fine.eigenvals, atol=1e-4)
+
+    for storage in ["upper", "packed"]:
+        other = Hamiltonian("potentials/sho.cfg", 40, assembly="dst",
+                            storage=storage, samples=dst.samples)
+        assert np.allclose(other.eigenvals[:5], dst.eigenvals)
+
+    coarse = Hamiltonian("potentials/sho.cfg", 40, assembly="dst", samples=80)
+    assert coarse.ham.shape == (40, 40)
+    with pytest.raises(ValueError):
+        Hamiltonian("potentials/sho.cfg", 40, assembly="dst", samples=50).ham
+
+    dst.extend(5)
+    assert dst.ham.shape == (45, 45)
+
+def test_tabulated_potential(tmpdir):
+    """Tests solving a tabulated potential, given as an object or a file,
+    with both the step and the sampled assembly.
+    """
+
+    from basis.potential import TabulatedPotential
+    x = np.linspace(-0.8, 3.2, 4001)
+    V = 15.*(x - 1.2)**2
+    pot = TabulatedPotential(x, V)
+    expected = Hamiltonian("potentials/sho.cfg", 30, assembly="dst",
+                           n_solutions=4).eigenvals
+
+    ham = Hamiltonian(pot, 30, n_solutions=4, assembly="dst")
+    assert ham.pot is pot
+    assert ham.domain == [-0.8, 3.2]
+    assert np.allclose(ham.eigenvals, expected, atol=1e-5)
+
+    table = str(tmpdir.join("sho.npy"))
+    np.save(table, np.column_stack([x, V]))
+    ham = Hamiltonian(table, 30, n_solutions=4)
+    assert ham.assembly == "dst"
+    assert np.allclose(ham.eigenvals, expected, atol=1e-5)
+    ham = Hamiltonian(table, 30, n_solutions=4, assembly="vectorized")
+    assert ham.divs == pytest.approx(1e-3)
+    assert np.allclose(ham.eigenvals, expected, atol=1e-4)
+
+def test_exact_steps():
+    """Tests that declared steps are used without evaluating the potential
+    and agree with the steps found by scanning.
+    """
+
+    from basis import timing
+    scanned = Hamiltonian("potentials/kp.cfg", 40)
+    exact = Hamiltonian("potentials/kp_steps.cfg", 40)
+    timing.reset()
+    timing.counting = True
+    try:
+        xr, width_b = exact._find_xrs()
+    finally:
+        timing.counting = False
+    assert "potential_calls" not in timing.report()["counters"]
+    assert width_b == [1.75]*10
+    assert xr == [2*i + 0.875 for i in range(10)]
+    assert np.allclose(exact.ham, scanned.ham, atol=1e-9)
+    assert np.array_equal(exact.ham, Hamiltonian("potentials/kp_steps.cfg", 40,
+                                                 assembly="reference").ham)
+
+def test_quadrature_assembly():
+    """Tests the Gauss-Legendre assembly against the exact matrix of a step
+    potential and the sampled assembly of a smooth one, and its error
+    estimate.
+    """
+
+    exact = Hamiltonian("potentials/bump.cfg", 30)
+    quad = Hamiltonian("potentials/bump.cfg", 30, assembly="quadrature")
+    assert quad.quad_error is None
+    assert np.allclose(quad.ham, exact.ham, atol=1e-10)
+    assert quad.quad_error < 1e-6
+
+    steps = Hamiltonian("potentials/kp_steps.cfg", 30, assembly="quadrature",
+                        storage="packed")
+    assert np.allclose(steps.ham,
+                       Hamiltonian("potentials/kp_steps.cfg", 30,
+                                   storage="packed").ham, atol=1e-10)
+
+    sampled = Hamiltonian("potentials/sho.cfg", 30, assembly="dst",
+                          samples=2**16)
+    errors = []
+    for order in [4, 8, 16]:
+        quad = Hamiltonian("potentials/sho.cfg", 30, assembly="quadrature",
+                           quad_order=order)
+        assert np.max(np.abs(quad.ham - sampled.ham)) < quad.quad_error + 1e-6
+        errors.append(quad.quad_error)
+    assert errors[0] > errors[1] > errors[2]
+
+    coarse = Hamiltonian("potentials/sho.cfg", 10, assembly="quadrature",
+                         quad_order=2)
+    coarse.ham
+    assert coarse.quad_error > 0
+    with pytest.raises(ValueError):
+        Hamiltonian("potentials/sho.cfg", 10, assembly="quadrature",
+                    quad_order=1)
+    assert np.allclose(quad.ham, sampled.ham, atol=1e-6)
+
+def test_structured():
+    """Tests that the Toeplitz-plus-Hankel storage represents the same
+    matrix as the dense assembly and gives the same spectrum.
+    """
+
+    from basis.hamiltonian import ToeplitzHankel
+    for potcfg, assembly in [("potentials/kp.cfg", "vectorized"),
+                             ("potentials/bump.cfg", "reference"),
+                             ("potentials/sho.cfg", "dst"),
+                             ("potentials/sho.cfg", "quadrature")]:
+        dense = Hamiltonian(potcfg, 40, assembly=assembly)
+        ham = Hamiltonian(potcfg, 40, assembly=assembly, storage="structured",
+                          solver="lanczos", n_solutions=5)
+        assert isinstance(ham.ham, ToeplitzHankel)
+        assert ham.ham.shape == (40, 40)
+        assert np.allclose(ham.ham.todense(), dense.ham, atol=1e-10)
+        assert np.allclose(ham.ham.diagonal(), np.diag(dense.ham))
+
+        v = np.random.rand(40, 3)
+        assert np.allclose(ham.ham.matvec(v), dense.ham.dot(v), atol=1e-10)
+        assert np.allclose(ham.ham.matvec(v[:,0]), dense.ham.dot(v[:,0]),
+                           atol=1e-10)
+        assert np.allclose(ham.eigenvals, dense.eigenvals[:5])
+
+    ham.extend(5)
+    assert ham.ham.shape == (45, 45)
+    assert np.allclose(ham.ham.todense(),
+                       Hamiltonian("potentials/sho.cfg", 45,
+                                   assembly="quadrature").ham, atol=1e-10)
+
+    lanczos = Hamiltonian("potentials/kp_steps.cfg", 400, storage="structured",
+                          n_solutions=4, solver="lanczos")
+    subset = Hamiltonian("potentials/kp_steps.cfg", 400, n_solutions=4)
+    assert np.allclose(lanczos.eigenvals, subset.eigenvals)
+    assert np.allclose(np.abs(np.sum(lanczos.eigenvecs*subset.eigenvecs,
+                                     axis=0)), 1.)
+
+    with pytest.raises(ValueError):
+        ToeplitzHankel(np.ones(5), np.ones(10))
+    with pytest.raises(ValueError):
+        Hamiltonian("potentials/kp.cfg", 10, storage="structured")
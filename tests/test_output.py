@@ -0,0 +1,52 @@
+"""Tests the writing and reading of solution files."""
+
+import pytest
+from basis.hamiltonian import Hamiltonian
+from basis.output import write_solution, load_solution
+import numpy as np
+
+def test_formats(tmpdir):
+    """Tests that both formats read back the solutions that were written.
+    """
+
+    ham = Hamiltonian("potentials/kp.cfg", 12)
+    text = str(tmpdir.join("kp.dat"))
+    binary = str(tmpdir.join("kp.bin"))
+    write_solution(ham, 4, text)
+    write_solution(ham, 4, binary, "npz")
+    assert not tmpdir.join("kp.bin.npz").check()
+
+    sol = load_solution(binary)
+    assert np.array_equal(sol["eigenvals"], ham.eigenvals[:4])
+    assert np.array_equal(sol["eigenvecs"], ham.eigenvecs[:,:4].T)
+    assert sol["domain"] == [0., 20.]
+    assert sol["n_basis"] == 12
+    assert sol["params"]["v0"] == 15.
+    assert sol["params"]["n"] == 10
+    assert sol["potcfg"] == ham.pot.filepath
+
+    sol_text = load_solution(text)
+    assert np.allclose(sol_text["eigenvals"], sol["eigenvals"])
+    assert np.allclose(sol_text["eigenvecs"], sol["eigenvecs"])
+    assert sol_text["n_basis"] == 12
+    assert sol_text["domain"] is None
+
+    with pytest.raises(ValueError):
+        write_solution(ham, 4, text, "dummy")
+
+def test_text_blocks(tmpdir):
+    """Tests that the text output doesn't depend on the block size and that
+    the eigenvectors are written by column.
+    """
+
+    from basis.output import write_text
+    ham = Hamiltonian("potentials/kp.cfg", 12)
+    whole = str(tmpdir.join("whole.dat"))
+    blocks = str(tmpdir.join("blocks.dat"))
+    write_text(ham, 5, whole)
+    write_text(ham, 5, blocks, block_size=2)
+    assert open(whole).read() == open(blocks).read()
+
+    sol = load_solution(blocks)
+    assert np.array_equal(sol["eigenvals"], ham.eigenvals[:5])
+    assert np.array_equal(sol["eigenvecs"], ham.eigenvecs[:,:5].T)
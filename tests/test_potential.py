@@ -5,6 +5,7 @@ import pytest
 from basis.potential import Potential
 import numpy as np
 import sys
+import os
 
 def test_adjust_potential():
     """Tests that the adjust potential won't assign values to a parameter
@@ -29,6 +30,38 @@ def test_parse_regions():
         pot = Potential("potentials/kp_3.cfg")
 
 
+def test_region_index(tmpdir):
+    """Tests the region lookup for a potential with many regions and that
+    overlapping or repeated regions are reported.
+    """
+
+    lines = ["[parameters]", "v0 = 2.", "", "[regions]"]
+    for i in range(300):
+        lines.append("{0}={0}, {0}+1 | v0*{1}".format(i, i % 3))
+    potcfg = tmpdir.join("superlattice.cfg")
+    potcfg.write("\n".join(lines))
+
+    pot = Potential(str(potcfg))
+    assert pot(-0.5) == 0.
+    assert pot(300.) == 0.
+    for x in [0., 0.5, 1., 151.25, 299.999]:
+        assert pot(x) == 2.*(int(x) % 3)
+    xa = np.linspace(-1, 301, 1000)
+    assert np.allclose(pot(xa), [pot(float(x)) for x in xa])
+    assert pot.region_function(151.25) == pot.regions[(151, 152)]
+    assert pot.region_function(-0.5) is None
+    assert pot.region_function(300.) is None
+
+    for regions in ["1=0, 2 | 1\n2=1, 3 | 2", "1=0, 2 | 1\n2=0, 2 | 2"]:
+        potcfg.write("[regions]\n" + regions)
+        with pytest.raises(ValueError):
+            Potential(str(potcfg))
+
+    potcfg.write("[regions]\n1=0, 1 | 1\n2=1, 2 | 2\n3=5, 4 | 3")
+    pot = Potential(str(potcfg))
+    assert pot(1.) == 2
+    assert pot(4.5) == 0.
+
 def test_getattr():
     """Tests the attribute re-routing to Potential.params.
     """
@@ -112,3 +145,171 @@ def test_bump():
             pot("a")
     
             
+
+def test_array():
+    """Tests that evaluating the potential on an array agrees with evaluating
+    it one value at a time.
+    """
+
+    for potcfg in ["potentials/kp.cfg", "potentials/sho.cfg",
+                   "potentials/bump.cfg", "potentials/kp_2.cfg"]:
+        pot = Potential(potcfg)
+        xa = np.linspace(-25, 25, 1001)
+        V = pot(xa)
+        assert V.shape == xa.shape
+        assert np.allclose(V, [pot(float(x)) for x in xa])
+        assert np.allclose(pot(list(xa)), V)
+        assert pot(xa.reshape(7, 143)).shape == (7, 143)
+
+    pot = Potential("potentials/kp.cfg")
+    pot(np.linspace(0, 20, 10))
+    assert list(pot._array_safe.values()) == [False]
+    pot = Potential("potentials/sho.cfg")
+    pot(np.linspace(0, 2, 10))
+    assert list(pot._array_safe.values()) == [True]
+
+    with pytest.raises(ValueError):
+        pot(["a", "b"])
+
+def test_tabulated():
+    """Tests the interpolation of tabulated potentials.
+    """
+
+    from basis.potential import TabulatedPotential
+    x = np.linspace(0., 4., 5)
+    pot = TabulatedPotential(x, x**2)
+    assert pot(1.5) == 2.5
+    assert pot(-1.) == 0.
+    assert pot(4.) == 16.
+    assert np.allclose(pot([0.5, 3.5, 5.]), [0.5, 12.5, 0.])
+    assert list(pot.regions) == [(0., 4.)]
+    assert pot.spacing == 1.
+
+    near = TabulatedPotential(x, x**2, kind="nearest")
+    assert np.allclose(near(np.array([0.4, 0.6, 3.9, 4.1])), [0., 1., 16., 0.])
+    assert near.fingerprint() != pot.fingerprint()
+    assert TabulatedPotential(x, x**2).fingerprint() == pot.fingerprint()
+
+    with pytest.raises(ValueError):
+        TabulatedPotential(x, x**2, kind="cubic")
+    with pytest.raises(ValueError):
+        TabulatedPotential(x[::-1], x**2)
+    with pytest.raises(ValueError):
+        TabulatedPotential(x, x[:-1])
+    with pytest.raises(ValueError):
+        pot("a")
+
+def test_read_table(tmpdir):
+    """Tests reading tabulated potentials from each of the file formats.
+    """
+
+    from basis.potential import read_table, load_potential
+    x = np.linspace(-1., 1., 101)
+    V = np.cos(x)
+    table = np.column_stack([x, V])
+    np.save(str(tmpdir.join("pot.npy")), table)
+    np.save(str(tmpdir.join("rows.npy")), table.T)
+    np.savez(str(tmpdir.join("pot.npz")), x=x, V=V)
+    np.savetxt(str(tmpdir.join("pot.csv")), table, delimiter=",",
+               header="x,V")
+    np.savetxt(str(tmpdir.join("pot.dat")), table)
+
+    for name in ["pot.npy", "rows.npy", "pot.npz", "pot.csv", "pot.dat"]:
+        pot = load_potential(str(tmpdir.join(name)))
+        assert np.allclose(pot(x), V)
+        assert pot.filepath == str(tmpdir.join(name))
+
+    assert isinstance(read_table(str(tmpdir.join("pot.npy"))).x, np.memmap)
+    assert isinstance(read_table(str(tmpdir.join("pot.npz"))).x, np.memmap)
+    assert not isinstance(read_table(str(tmpdir.join("pot.npy")),
+                                     mmap=False).x, np.memmap)
+
+    np.save(str(tmpdir.join("bad.npy")), np.zeros((3, 3)))
+    with pytest.raises(ValueError):
+        read_table(str(tmpdir.join("bad.npy")))
+    assert not hasattr(load_potential("potentials/kp.cfg"), "kind")
+
+def test_compiled_regions(tmpdir):
+    """Tests that the region expressions are compiled once, that adjusting
+    the parameters only re-evaluates the regions that use them, and that
+    the expressions are limited to the functions of their namespace.
+    """
+
+    from basis import potential
+    lines = ["[parameters]", "v0 = 2.", "w = 1.", "c = 3", "", "[regions]",
+             "1=0, w | v0", "2=w, 2*w | lambda x: v0*x", "3=5, 6 | c"]
+    potcfg = tmpdir.join("compiled.cfg")
+    potcfg.write("\n".join(lines))
+
+    pot = Potential(str(potcfg))
+    n_compiled = len(potential._compiled)
+    Potential(str(potcfg))
+    assert len(potential._compiled) == n_compiled
+
+    constant = pot.regions[(5, 6)]
+    pot.adjust_potential(v0=4., w=2.)
+    assert pot(1.) == 4.
+    assert pot(3.) == 12.
+    assert sorted(pot.regions) == [(0, 2.), (2., 4.), (5, 6)]
+    assert pot.regions[(5, 6)] is constant
+
+    fresh = Potential(str(potcfg))
+    fresh.adjust_potential(v0=4., w=2.)
+    xs = np.linspace(-1, 7, 81)
+    assert np.array_equal(pot(xs), fresh(xs))
+
+    for expr in ["().__class__", "__import__('os')", "open('x')",
+                 "operator.attrgetter('__class__.__base__')(())",
+                 "numpy.savetxt('x.txt', [1.])",
+                 "'{0.__class__}'.format(())"]:
+        potcfg.write("[regions]\n1=0, 1 | {}".format(expr))
+        with pytest.raises((ValueError, NameError, AttributeError)):
+            Potential(str(potcfg))
+    potcfg.write("[parameters]\nv0 = numpy.savetxt('x.txt', [1.]) or 1.\n"
+                 "[regions]\n1=0, 1 | v0")
+    with pytest.raises(AttributeError):
+        Potential(str(potcfg))
+    assert not os.path.exists("x.txt")
+
+    for i in range(potential._compiled_size + 5):
+        potcfg.write("[regions]\n1=0, {} | 1.".format(i + 1))
+        Potential(str(potcfg))
+    assert len(potential._compiled) == potential._compiled_size
+
+    potcfg.write("[parameters]\nv0 = [1., 2.]\n[regions]\n"
+                 "1=0, 1 | lambda x: v0[0]")
+    pot = Potential(str(potcfg))
+    pot.params["v0"] = np.array([1., 2.])
+    pot.adjust_potential(v0=np.array([3., 2.]))
+    assert pot(0.5) == 3.
+    pot.adjust_potential(v0=np.array([3., 2.]))
+
+def test_steps():
+    """Tests the declared and detected steps of piecewise constant
+    potentials.
+    """
+
+    from basis.potential import StepFunction
+    kp = Potential("potentials/kp.cfg")
+    steps = Potential("potentials/kp_steps.cfg")
+    xs = np.linspace(-1, 21, 2001)
+    assert np.array_equal(kp(xs), steps(xs))
+    assert steps(1.74) == 15. and steps(1.76) == 0.
+
+    found = steps.steps(0., 20.)
+    assert len(found) == 20
+    assert found[:2] == [(0., 1.75, 15.), (1.75, 2., 0.)]
+    assert kp.steps(0., 20.) is None
+    assert Potential("potentials/bump.cfg").steps(-3., 2.) == [
+        (-3., -1., 0.), (-1., 1., -15.), (1., 2., 0.)]
+
+    steps.adjust_potential(n=2, v0=5.)
+    assert steps.steps(0., 4.) == [(0., 1.75, 5.), (1.75, 2., 0.),
+                                   (2., 3.75, 5.), (3.75, 4., 0.)]
+
+    function = StepFunction([(2, 3, 1.), (0, 1, -1.)])
+    assert np.array_equal(function(np.array([-1, 0, 0.5, 1.5, 2, 3])),
+                          [0., -1., -1., 0., 1., 0.])
+    assert function(2.5) == 1.
+    with pytest.raises(ValueError):
+        StepFunction([(0, 2, 1.), (1, 3, 2.)])
@@ -0,0 +1,46 @@
+"""Tests the memory-mapped reader for binary solution files."""
+
+import pytest
+from basis.hamiltonian import Hamiltonian
+from basis.output import write_solution
+from basis.reader import SolutionReader, spectra
+import numpy as np
+
+def test_reader(tmpdir):
+    """Tests that the mapped arrays match the solution that was written.
+    """
+
+    ham = Hamiltonian("potentials/kp.cfg", 12)
+    outfile = str(tmpdir.join("kp.npz"))
+    write_solution(ham, 4, outfile, "npz")
+
+    sol = SolutionReader(outfile)
+    assert isinstance(sol.eigenvals, np.memmap)
+    assert not sol.eigenvals.flags.writeable
+    assert np.array_equal(sol.eigenvals, ham.eigenvals[:4])
+    assert np.array_equal(sol.eigenvec(2), ham.eigenvecs[:,2])
+    assert sol.eigenvecs.shape == (4, 12)
+    assert sol.domain == [0., 20.]
+    assert sol.n_basis == 12
+    assert sol.params["w"] == 2.
+    assert sol.potcfg == ham.pot.filepath
+
+    vals = spectra([outfile, outfile])
+    assert len(vals) == 2
+    assert np.array_equal(vals[1], ham.eigenvals[:4])
+
+def test_unmappable(tmpdir):
+    """Tests that text and compressed files are reported.
+    """
+
+    ham = Hamiltonian("potentials/bump.cfg", 4)
+    text = str(tmpdir.join("bump.dat"))
+    write_solution(ham, 2, text)
+    with pytest.raises(ValueError):
+        SolutionReader(text)
+
+    compressed = str(tmpdir.join("bump.npz"))
+    np.savez_compressed(compressed, eigenvals=ham.eigenvals)
+    sol = SolutionReader(compressed)
+    with pytest.raises(ValueError):
+        sol.eigenvals
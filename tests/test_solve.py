@@ -2,6 +2,7 @@
 """
 import pytest
 import os
+import numpy as np
 # The virtual, pseudorandom port is setup as a session fixture in conftest.py
 def get_sargs(args):
     """Returns the list of arguments parsed from sys.argv.
@@ -54,3 +55,154 @@ def test_run(capfd):
     args = get_sargs(argv)
     with pytest.raises(KeyError):
         run(args)    
+
+def test_sweep(tmpdir):
+    """Tests that a sweep writes one output file per point.
+    """
+
+    from basis.solve import run
+    outfile = str(tmpdir.join("sweep.dat"))
+    argv = ["py.test", "10", "-potential", "potentials/paper.cfg", "-outfile",
+            outfile, "-solutions", "3", "-sweep", "n=1:2", "v0=50,100"]
+    args = get_sargs(argv)
+    run(args)
+    for i in range(1, 5):
+        with open(str(tmpdir.join("sweep_{}.dat".format(i)))) as f:
+            lines = f.readlines()
+        assert len(lines) == 4
+        assert len(lines[1].split()) == 11
+    assert not tmpdir.join("sweep_5.dat").check()
+
+def test_parallel_sweep(tmpdir):
+    """Tests that a sweep on worker processes writes the same files as the
+    serial sweep.
+    """
+
+    from basis.solve import run
+    for name, extra in [("serial", []), ("parallel", ["-workers", "2"])]:
+        outfile = str(tmpdir.join(name + ".dat"))
+        argv = ["py.test", "10", "-potential", "potentials/paper.cfg",
+                "-outfile", outfile, "-solutions", "3", "-sweep", "n=1:3"]
+        run(get_sargs(argv + extra))
+
+    for i in range(1, 4):
+        serial = np.loadtxt(str(tmpdir.join("serial_{}.dat".format(i))), skiprows=1)
+        parallel = np.loadtxt(str(tmpdir.join("parallel_{}.dat".format(i))), skiprows=1)
+        assert np.allclose(abs(serial), abs(parallel))
+
+    # Resuming leaves the existing outputs alone.
+    tmpdir.join("parallel_2.dat").write("done")
+    argv = ["py.test", "10", "-potential", "potentials/paper.cfg", "-outfile",
+            str(tmpdir.join("parallel.dat")), "-solutions", "3", "-sweep",
+            "n=1:3", "-resume"]
+    run(get_sargs(argv))
+    assert tmpdir.join("parallel_2.dat").read() == "done"
+
+def test_format(tmpdir):
+    """Tests the binary output option.
+    """
+
+    from basis.solve import run
+    from basis.output import load_solution
+    outfile = str(tmpdir.join("bump.npz"))
+    argv = ["py.test", "4", "-potential", "potentials/bump.cfg", "-outfile",
+            outfile, "-solutions", "2", "-format", "npz"]
+    run(get_sargs(argv))
+    sol = load_solution(outfile)
+    assert sol["eigenvecs"].shape == (2, 4)
+    assert sol["domain"] == [-2., 2.]
+
+def test_cache(tmpdir):
+    """Tests the cache options of the script.
+    """
+
+    from basis.solve import run
+    cache = tmpdir.join("cache")
+    argv = ["py.test", "4", "-potential", "potentials/bump.cfg", "-outfile",
+            str(tmpdir.join("bump.dat")), "-solutions", "2"]
+    run(get_sargs(argv + ["-cache", str(cache), "-no-cache"]))
+    assert not cache.check()
+    run(get_sargs(argv + ["-cache", str(cache)]))
+    assert len(cache.listdir()) == 2
+
+def test_converge(tmpdir):
+    """Tests the basis convergence option of the script.
+    """
+
+    from basis.solve import run
+    outfile = str(tmpdir.join("sho.dat"))
+    argv = ["py.test", "10", "-potential", "potentials/sho.cfg", "-outfile",
+            outfile, "-solutions", "2", "-converge", "1e-2"]
+    run(get_sargs(argv))
+    lines = open(outfile).readlines()
+    assert len(lines) == 3
+    assert len(lines[1].split()) > 11
+
+    run(get_sargs(argv + ["-max_basis", "10"]))
+    assert len(open(outfile).readlines()[1].split()) == 11
+
+def test_assembly(tmpdir):
+    """Tests that tables of the potential are assembled with the 'dst'
+    method by default and that -assembly picks the method.
+    """
+
+    from basis.solve import run
+    from basis.hamiltonian import Hamiltonian
+    x = np.linspace(-0.8, 3.2, 4001)
+    table = str(tmpdir.join("sho.npy"))
+    np.save(table, np.column_stack([x, 15.*(x - 1.2)**2]))
+    assert Hamiltonian(table, 10).assembly == "dst"
+    assert Hamiltonian("potentials/sho.cfg", 10).assembly == "vectorized"
+
+    outfile = str(tmpdir.join("sho.dat"))
+    argv = ["py.test", "30", "-potential", table, "-outfile", outfile,
+            "-solutions", "3"]
+    run(get_sargs(argv))
+    default = np.loadtxt(outfile, skiprows=1, max_rows=1)
+    run(get_sargs(argv + ["-assembly", "vectorized"]))
+    vectorized = np.loadtxt(outfile, skiprows=1, max_rows=1)
+    assert np.allclose(default, vectorized, atol=1e-3)
+
+def test_timing(tmpdir):
+    """Tests the timing report and profile options of the script.
+    """
+
+    import json
+    from basis.solve import run
+    report = str(tmpdir.join("timing.json"))
+    profile = str(tmpdir.join("solve.prof"))
+    argv = ["py.test", "10", "-potential", "potentials/kp.cfg", "-outfile",
+            str(tmpdir.join("kp.dat")), "-timing", report, "-profile",
+            profile]
+    run(get_sargs(argv))
+    with open(report) as f:
+        contents = json.load(f)
+    phases = [entry["name"] for entry in contents["phases"]]
+    assert phases == ["parse", "find_xrs", "assemble", "diagonalize", "write"]
+    assert contents["counters"]["potential_calls"] > 0
+    assert os.path.isfile(profile)
+
+    cwd = os.getcwd()
+    tmpdir.chdir()
+    try:
+        run(get_sargs(["py.test", "10", "-potential",
+                       os.path.join(cwd, "potentials/kp.cfg"), "-outfile",
+                       "kp.dat", "-debug"]))
+    finally:
+        os.chdir(cwd)
+    assert not tmpdir.join("basis.prof").check()
+
+def test_import_time():
+    """Tests that importing the script doesn't load the plotting or
+    terminal coloring libraries.
+    """
+
+    import subprocess
+    import sys
+    check = ("import sys, basis.solve; print(sorted(name for name in "
+             "sys.modules if name.split('.')[0] in "
+             "('matplotlib', 'termcolor')))")
+    out = subprocess.run([sys.executable, "-c", check],
+                         stdout=subprocess.PIPE, universal_newlines=True,
+                         check=True).stdout
+    assert out.strip() == "[]"
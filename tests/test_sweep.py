@@ -0,0 +1,42 @@
+"""Tests the parameter sweeps over 1D-quantum potentials."""
+
+import pytest
+from basis.hamiltonian import Hamiltonian
+from basis.sweep import parse_sweep, sweep_grid, sweep
+import numpy as np
+
+def test_parse_sweep():
+    """Tests the parsing of the parameter ranges.
+    """
+
+    assert parse_sweep(["n=1:3"]) == [("n", [1, 2, 3])]
+    assert parse_sweep(["V0=0:1:0.5", "n=4,2"]) == [("v0", [0., 0.5, 1.]),
+                                                    ("n", [4, 2])]
+    assert parse_sweep(["w=3:1:-1"]) == [("w", [3, 2, 1])]
+
+    for spec in ["n", "n=1:2:3:4", "n=a:b", "n=1:3:0", "n=1:3:-1", "n=1=2"]:
+        with pytest.raises(ValueError):
+            parse_sweep([spec])
+
+def test_sweep_grid():
+    """Tests the expansion of the ranges into the sweep points.
+    """
+
+    grid = sweep_grid([("n", [1, 2]), ("v0", [10, 20, 30])])
+    assert len(grid) == 6
+    assert grid[0] == {"n": 1, "v0": 10}
+    assert grid[1] == {"n": 1, "v0": 20}
+    assert grid[-1] == {"n": 2, "v0": 30}
+
+def test_sweep():
+    """Tests that reusing the hamiltonian over a sweep gives the same
+    solutions as solving each point from scratch.
+    """
+
+    grid = sweep_grid(parse_sweep(["n=1:3", "v0=50,100"]))
+    for params, ham in sweep("potentials/paper.cfg", 20, grid, n_solutions=4):
+        fresh = Hamiltonian("potentials/paper.cfg", 20)
+        fresh.adjust_potential(**params)
+        assert ham.domain == [0, params["n"]*1.]
+        assert np.allclose(ham.ham, fresh.ham)
+        assert np.allclose(ham.eigenvals, fresh.eigenvals[:4])
@@ -0,0 +1,58 @@
+"""Tests the timing of the phases of a solve."""
+
+import pytest
+from basis import timing
+from basis.hamiltonian import Hamiltonian
+import json
+
+def test_phases(tmpdir):
+    """Tests that the phases of a solve are timed and the evaluations of the
+    potential are counted.
+    """
+
+    timing.reset()
+    Hamiltonian("potentials/kp.cfg", 20).eigenvals
+    assert timing.report()["counters"] == {}
+
+    timing.reset()
+    timing.counting = True
+    try:
+        ham = Hamiltonian("potentials/kp.cfg", 20)
+        ham.eigenvals
+    finally:
+        timing.counting = False
+    report = timing.report()
+    names = [entry["name"] for entry in report["phases"]]
+    assert names == ["parse", "find_xrs", "assemble", "diagonalize"]
+    assert all(entry["calls"] == 1 and entry["time"] >= 0
+               for entry in report["phases"])
+    assert report["counters"]["potential_calls"] > 0
+    assert (report["counters"]["potential_points"] >=
+            report["counters"]["potential_calls"])
+
+    with timing.phase("assemble"):
+        timing.count("custom", 3)
+    report = timing.report()
+    assert report["phases"][2]["calls"] == 2
+    assert report["counters"]["custom"] == 3
+
+    outfile = str(tmpdir.join("timing.json"))
+    timing.write_report(outfile)
+    with open(outfile) as f:
+        assert json.load(f) == report
+
+    timing.reset()
+    assert timing.report() == {"phases": [], "counters": {}}
+
+def test_profile(tmpdir):
+    """Tests the optional profiling of a block of code.
+    """
+
+    import pstats
+    outfile = str(tmpdir.join("solve.prof"))
+    with timing.profile(outfile):
+        Hamiltonian("potentials/kp.cfg", 10).eigenvals
+    assert pstats.Stats(outfile).total_calls > 0
+
+    with timing.profile():
+        pass
@@ -0,0 +1,38 @@
+"""Tests the evaluation of eigenstates in real space."""
+
+import pytest
+from basis.hamiltonian import Hamiltonian
+from basis.wavefunction import sine_basis, psi, psi_grid
+import numpy as np
+
+def test_psi():
+    """Tests the matrix product evaluation against the basis expansion.
+    """
+
+    ham = Hamiltonian("potentials/kp.cfg", 20, n_solutions=5)
+    xs = np.linspace(0, 20, 37)
+    L = 20.
+    for i in range(5):
+        wave = ham.eigenvecs[:,i]
+        expected = [sum(wave[n]*np.sqrt(2./L)*np.sin((n+1)*np.pi*x/L)
+                        for n in range(20)) for x in xs]
+        assert np.allclose(psi(ham, xs, i)[:,0], expected)
+
+    assert psi(ham, xs).shape == (37, 5)
+    assert psi(ham, xs, [0, 3]).shape == (37, 2)
+    assert psi(ham, 1.5, slice(1, 3)).shape == (1, 2)
+    assert np.allclose(sine_basis(xs, 20, L).T.dot(sine_basis(xs, 20, L))[0,0]*
+                       (xs[1] - xs[0]), 1.)
+
+def test_psi_grid():
+    """Tests that the transform evaluation on uniform grids agrees with the
+    matrix product, including domains that don't start at zero.
+    """
+
+    for xi, xf in [(None, None), (-3., 17.)]:
+        ham = Hamiltonian("potentials/kp.cfg", 30, xi, xf, n_solutions=4)
+        for n_points in [10, 30, 257]:
+            xs, values = psi_grid(ham, n_points, [0, 2])
+            assert len(xs) == n_points
+            assert xs[0] > ham.domain[0] and xs[-1] < ham.domain[1]
+            assert np.allclose(values, psi(ham, xs, [0, 2]))